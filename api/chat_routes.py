@@ -1,19 +1,133 @@
 """
 Chat conversation API routes
 """
-from flask import Blueprint, request, jsonify, session
+import asyncio
+import logging
+import re
+import orjson
+from flask import Blueprint, Response, current_app, request, jsonify, session, stream_with_context
 from utils import (
-    init_session, sanitize_user_input, get_db_chain, 
-    get_database_schema_info, get_llm_client, 
-    generate_sql_query_with_llm, is_read_only_query,
-    clean_sql_results, generate_natural_language_response,
-    create_sql_agent_fallback
+    init_session, sanitize_user_input, is_modification_request, get_db_chain, run_query,
+    get_cached_schema_info, get_llm_client, get_sql_llm, get_response_llm,
+    response_cache_key, get_cached_response, cache_response, invalidate_cached_responses,
+    build_history_message, agenerate_sql_query_with_llm, arepair_sql_query, is_read_only_query, is_out_of_scope,
+    clean_sql_results, render_answer_template, format_trivial_answer, create_sql_agent_fallback
 )
+from utils.response_generator import _generate_response_with_status, _agenerate_response_with_status
 
 chat_bp = Blueprint('chat', __name__)
+logger = logging.getLogger(__name__)
+
+# Data-modification keywords in agent output, and modification intent in
+# LLM reasoning; substring matches, same as the keyword lists they replace
+_MOD_SQL_RE = re.compile(r'INSERT|UPDATE|DELETE|DROP|ALTER', re.IGNORECASE)
+_MOD_INTENT_RE = re.compile(r'modify|update|delete|insert|change|remove', re.IGNORECASE)
+
+# Whole-message greetings, thanks and help requests that need no database work
+_SMALL_TALK_RE = re.compile(
+    r"^\s*(?:(?P<greeting>hi|hello|hey|greetings|good\s+(?:morning|afternoon|evening))"
+    r"|(?P<thanks>thanks|thank\s+you|thx|cheers)"
+    r"|(?P<help>help|what\s+can\s+you\s+do))"
+    r"(?:\s+(?:there|again|so\s+much|a\s+lot))?[\s!.,?]*$",
+    re.IGNORECASE
+)
+
+_SMALL_TALK_RESPONSES = {
+    'greeting': "Hello! 👋 Ask me anything about the data in your connected database.",
+    'thanks': "You're welcome! Let me know if there's anything else you'd like to know about your data.",
+    'help': "I can answer questions about your connected database in plain English - for example counts, top-N lists, totals, averages or details about specific records. I'm read-only, so I can't change any data."
+}
+
+
+_READ_ONLY_NOTICE = (
+    "🔒 **Security Notice:** This chatbot is read-only and cannot modify database contents.\n\n"
+    "I can help you view and analyze data. What would you like to know about your database?"
+)
+
+
+def _small_talk_response(user_query: str):
+    """Canned reply for greetings/thanks/help, or None for real questions"""
+    match = _SMALL_TALK_RE.match(user_query)
+    if not match:
+        return None
+    return _SMALL_TALK_RESPONSES[match.lastgroup]
+
+
+def _persist_session(app, current_session):
+    """Write the session to its store outside Flask's end-of-request save"""
+    try:
+        app.session_interface.save_session(app, current_session, app.response_class())
+    except Exception as e:
+        logger.exception("Session save error: %s", e)
 
 
 def process_user_query(user_query: str) -> str:
+    """
+    Complete pipeline - EXACT SAME LOGIC as original
+    Runs the async pipeline to completion for the sync Flask handler
+    """
+    return asyncio.run(process_user_query_async(user_query))
+
+
+def _cache_when_complete(chunks, cache_key: str, confidence: float):
+    """
+    Pass streamed chunks through and cache the full answer at the end, unless
+    the LLM failed and the answer is the plain-results fallback (a transient
+    error shouldn't be served to every later asker)
+    """
+    parts = []
+    while True:
+        try:
+            chunk = next(chunks)
+        except StopIteration as done:
+            generated = done.value
+            break
+        parts.append(chunk)
+        yield chunk
+    if generated:
+        cache_response(cache_key, ''.join(parts), confidence)
+
+
+def _get_llm_clients():
+    """
+    Answer and SQL generation clients
+    Returns: (response_llm, sql_llm)
+    """
+    return get_response_llm(), get_sql_llm()
+
+
+async def _run_query_with_repair(db, query_info: dict, user_query: str, schema_info: dict, sql_llm,
+                                 custom_directive: str, max_rows: int):
+    """
+    Runs the generated query; if the database rejects it, asks the LLM once
+    for a corrected query (given the error) and runs that instead
+    One row past max_rows is read, so a capped result can be told apart
+    from one that fits exactly
+    Returns: (query_info actually run, column names, rows, truncated)
+    """
+    sql_query = query_info['sql_query']
+    try:
+        columns, rows = await asyncio.to_thread(run_query, db, sql_query, max_rows + 1)
+    except Exception as sql_error:
+        logger.warning("SQL Execution Error, attempting repair: %s", sql_error)
+        repaired_info = await arepair_sql_query(
+            user_query, sql_query, str(sql_error), schema_info, sql_llm, custom_directive
+        )
+        repaired_sql = repaired_info.get('sql_query')
+        if not repaired_sql or not is_read_only_query(repaired_sql)[0]:
+            raise
+        logger.info("REPAIRED SQL: %s", repaired_sql)
+        query_info = repaired_info
+        columns, rows = await asyncio.to_thread(run_query, db, repaired_sql, max_rows + 1)
+    
+    truncated = len(rows) > max_rows
+    if truncated:
+        logger.info("Result capped at %d rows", max_rows)
+        rows = rows[:max_rows]
+    return query_info, columns, rows, truncated
+
+
+async def process_user_query_async(user_query: str, stream: bool = False):
     """
     Complete pipeline - EXACT SAME LOGIC as original
     1. Sanitize input
@@ -22,6 +136,11 @@ def process_user_query(user_query: str) -> str:
     4. Validate SQL is read-only
     5. Execute query
     6. Convert to natural language
+    
+    The database handle is prepared in a worker thread while the SQL
+    generation call is in flight, and blocking DB calls run off the loop.
+    With stream=True the natural-language answer is returned as an
+    iterator of text deltas; every other outcome is still a string.
     """
     
     # Step 0: Sanitize user input
@@ -32,40 +151,77 @@ def process_user_query(user_query: str) -> str:
     if not db_config:
         return "Please connect to a database first."
     
+    # Small talk is answered before any schema or LLM work
+    small_talk = _small_talk_response(sanitized_query)
+    if small_talk:
+        return small_talk
+    
+    # Obvious requests to change data are refused without an LLM call
+    if is_modification_request(sanitized_query):
+        return _READ_ONLY_NOTICE
+    
+    # Read once and passed down, rather than looked up at each step
+    custom_directive = session.get('chatbot_directive')
+    
+    # Repeated questions are answered from the shared response cache
+    cache_key = response_cache_key(
+        db_config, sanitized_query,
+        custom_directive, session.get('messages', [])
+    )
+    cached_response = get_cached_response(cache_key)
+    if cached_response is not None:
+        return cached_response
+    
     try:
-        db = get_db_chain(db_config)
+        # Open the database handle concurrently with SQL generation
+        db_task = asyncio.create_task(asyncio.to_thread(get_db_chain, db_config))
         
-        # Get or create schema cache
+        # Get or create schema cache; on a session's first question the schema
+        # load and the (import-heavy) LLM client setup run side by side
         schema_info = session.get('schema_cache')
-        if not schema_info:
-            schema_info = get_database_schema_info(db_config)
+        if schema_info:
+            response_llm, sql_llm = _get_llm_clients()
+        else:
+            schema_info, (response_llm, sql_llm) = await asyncio.gather(
+                asyncio.to_thread(get_cached_schema_info, db_config),
+                asyncio.to_thread(_get_llm_clients)
+            )
             session['schema_cache'] = schema_info
         
-        llm = get_llm_client(temperature=0.3)
-        
-        # Get conversation history and directive
+        # Get conversation history
         conversation_history = session.get('messages', [])
-        custom_directive = session.get('chatbot_directive')
+        
+        # Questions unrelated to the schema are refused before any SQL LLM
+        # call; the local check overlaps only with opening the database handle,
+        # since an in-flight LLM request can't be called back once it is sent
+        scope_threshold = current_app.config['SCOPE_CHECK_THRESHOLD']
+        if scope_threshold > 0:
+            previous_question = next(
+                (msg.get('content') for msg in reversed(conversation_history[:-1]) if msg.get('role') == 'user'),
+                None
+            )
+            if await asyncio.to_thread(is_out_of_scope, sanitized_query, schema_info, scope_threshold, previous_question):
+                table_list = ', '.join(list(schema_info['tables'])[:8])
+                return f"I can only answer questions about the data in this database. Try asking about: {table_list}."
         
         # Step 1: Generate SQL query using LLM with conversation history
-        query_info = generate_sql_query_with_llm(
+        query_info = await agenerate_sql_query_with_llm(
             sanitized_query, 
             schema_info, 
-            llm,
+            sql_llm,
             conversation_history=conversation_history,
             custom_directive=custom_directive
         )
+        db = await db_task
         
         sql_query = query_info.get('sql_query')
         confidence = query_info.get('confidence', 0.0)
         reasoning = query_info.get('reasoning', '')
         
-        print(f"\n{'='*50}")
-        print(f"USER QUERY: {sanitized_query}")
-        print(f"REASONING: {reasoning}")
-        print(f"CONFIDENCE: {confidence}")
-        print(f"GENERATED SQL: {sql_query}")
-        print(f"{'='*50}\n")
+        logger.info(
+            "USER QUERY: %s | REASONING: %s | CONFIDENCE: %s | GENERATED SQL: %s",
+            sanitized_query, reasoning, confidence, sql_query
+        )
         
         # Step 2: Security validation - Check if query is read-only
         if sql_query:
@@ -76,40 +232,79 @@ def process_user_query(user_query: str) -> str:
         # Step 3: Execute query if confidence is reasonable
         if sql_query and confidence > 0.4:
             try:
-                sql_result = db.run(sql_query)
+                max_rows = current_app.config['MAX_RESULT_ROWS']
+                query_info, columns, rows, truncated = await _run_query_with_repair(
+                    db, query_info, sanitized_query, schema_info, sql_llm, custom_directive, max_rows
+                )
                 
                 # Step 4: Convert to natural language
-                if sql_result and sql_result.strip() and sql_result != "[]":
-                    # Debug logging
-                    print(f"RAW SQL RESULT: {sql_result[:200]}...")
+                if rows:
+                    debug = logger.isEnabledFor(logging.DEBUG)
+                    if debug:
+                        logger.debug("RAW SQL RESULT: %d rows, first: %r", len(rows), rows[0])
+                    
+                    # The SQL generation call already wrote the answer around the results;
+                    # small, simple results skip the second LLM call. A capped
+                    # result is never complete enough for either shortcut
+                    answer_template = query_info.get('answer_template')
+                    if not truncated and isinstance(answer_template, str) and '{rows}' in answer_template:
+                        natural_response = render_answer_template(answer_template, rows)
+                        if natural_response is not None:
+                            cache_response(cache_key, natural_response, confidence)
+                            return natural_response
                     
-                    cleaned_result = clean_sql_results(sql_result)
+                    # A single value or short list needs no rewording either
+                    natural_response = None if truncated else format_trivial_answer(columns, rows)
+                    if natural_response is not None:
+                        cache_response(cache_key, natural_response, confidence)
+                        return natural_response
                     
-                    print(f"CLEANED RESULT: {cleaned_result[:200]}...")
+                    if stream:
+                        return _cache_when_complete(
+                            _generate_response_with_status(
+                                sanitized_query,
+                                rows,
+                                response_llm,
+                                custom_directive=custom_directive,
+                                stream=True,
+                                truncated=truncated
+                            ),
+                            cache_key,
+                            confidence
+                        )
                     
-                    natural_response = generate_natural_language_response(
+                    natural_response, generated = await _agenerate_response_with_status(
                         sanitized_query, 
-                        cleaned_result, 
-                        llm,
-                        custom_directive=custom_directive
+                        rows, 
+                        response_llm,
+                        custom_directive=custom_directive,
+                        truncated=truncated
                     )
                     
-                    print(f"NATURAL RESPONSE: {natural_response[:200]}...")
+                    if debug:
+                        logger.debug("NATURAL RESPONSE: %s...", natural_response[:200])
                     
+                    # Only confident questions the LLM actually answered are cached
+                    if generated:
+                        cache_response(cache_key, natural_response, confidence)
                     return natural_response
                 else:
-                    return "I couldn't find any results matching your query. Could you try rephrasing or asking something else?"
+                    return query_info.get('empty_answer') or "I couldn't find any results matching your query. Could you try rephrasing or asking something else?"
                     
             except Exception as sql_error:
-                print(f"SQL Execution Error: {sql_error}")
-                # Fallback to SQL agent
-                return fallback_to_sql_agent(sanitized_query, db, llm, custom_directive)
+                logger.warning("SQL Execution Error: %s", sql_error)
+                # The multi-step SQL agent only when enabled; otherwise the repair attempt was the fallback
+                if current_app.config['SQL_AGENT_FALLBACK']:
+                    # Unbounded general-purpose client for the SQL agent
+                    llm = get_llm_client(temperature=0.3)
+                    return await asyncio.to_thread(fallback_to_sql_agent, sanitized_query, db, llm, custom_directive)
+                return "I wasn't able to run a query for that question. Could you try rephrasing it?"
         
         else:
             # Low confidence or out-of-scope query
             if confidence == 0.0:
                 # Check if it's a modification request
-                if any(keyword in reasoning.lower() for keyword in ['modify', 'update', 'delete', 'insert', 'change', 'remove']):
+                if _MOD_INTENT_RE.search(reasoning):
                     return f"🔒 **Security Notice:** This chatbot is read-only and cannot modify database contents.\n\n{reasoning}\n\nI can help you view and analyze data. What would you like to know about your database?"
                 else:
                     clean_reasoning = reasoning.replace("SQL query", "search").replace("generate", "find").replace("database query", "information")
@@ -118,7 +313,7 @@ def process_user_query(user_query: str) -> str:
                 return "I'm not quite sure what you're asking for. Could you please provide more details or rephrase your question?"
             
     except Exception as e:
-        print(f"Processing Error: {e}")
+        logger.exception("Processing Error: %s", e)
         return f"I encountered an error processing your question. Could you try rephrasing it?"
 
 
@@ -138,12 +333,12 @@ def fallback_to_sql_agent(user_query: str, db, llm, custom_directive: str = None
         # Clean any raw SQL results in agent output
         if "[(" in output or "Decimal(" in output:
             output = clean_sql_results(output)
-        if any(keyword in output.upper() for keyword in ['INSERT', 'UPDATE', 'DELETE', 'DROP', 'ALTER']):
+        if _MOD_SQL_RE.search(output):
             return "🔒 Security Alert: Cannot execute data modification queries. This chatbot is read-only."
         
         return output if output else "I couldn't process that request. Please try rephrasing."
     except Exception as e:
-        print(f"Agent Error: {e}")
+        logger.exception("Agent Error: %s", e)
         return "I'm having trouble understanding that question. Could you rephrase it?"
 
 
@@ -169,28 +364,87 @@ def chat():
                 'message': 'Message cannot be empty'
             }), 400
         
-        # Add user message to history
+        # Add user message to history (same list object as the session's,
+        # so the pipeline sees it as part of the conversation)
         messages = session.get('messages', [])
-        messages.append({
-            "role": "user",
-            "content": user_message
-        })
-        session['messages'] = messages
+        messages.append(build_history_message("user", user_message))
         
         # Process query
         response_text = process_user_query(user_message)
         
         # Add assistant response to history
-        messages.append({
-            "role": "assistant",
-            "content": response_text
-        })
-        session['messages'] = messages
+        messages.append(build_history_message("assistant", response_text))
         
-        return jsonify({
+        response = jsonify({
             'success': True,
             'response': response_text
-        }), 200
+        })
+        
+        # Persist the history once the response has been sent, so the client
+        # never waits on the session store write
+        app = current_app._get_current_object()
+        current_session = session._get_current_object()
+        
+        def save_history():
+            current_session['messages'] = messages
+            _persist_session(app, current_session)
+        
+        response.call_on_close(save_history)
+        return response, 200
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Chat error: {str(e)}'
+        }), 500
+
+
+@chat_bp.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Process chat message, streaming the answer as server-sent events"""
+    try:
+        init_session()
+        
+        # Check if database is connected
+        if not session.get('db_connected', False):
+            return jsonify({
+                'success': False,
+                'message': 'Please connect to a database first'
+            }), 400
+        
+        data = request.get_json()
+        user_message = data.get('message', '').strip()
+        
+        if not user_message:
+            return jsonify({
+                'success': False,
+                'message': 'Message cannot be empty'
+            }), 400
+        
+        # Add user message to history
+        messages = session.get('messages', [])
+        messages.append(build_history_message("user", user_message))
+        session['messages'] = messages
+        
+        # Everything up to the natural-language answer runs before streaming starts
+        result = asyncio.run(process_user_query_async(user_message, stream=True))
+        chunks = [result] if isinstance(result, str) else result
+        
+        def generate():
+            parts = []
+            for chunk in chunks:
+                parts.append(chunk)
+                yield b"data: " + orjson.dumps({'delta': chunk}) + b"\n\n"
+            
+            # The session was saved when the response started; persist the
+            # completed answer explicitly
+            messages.append(build_history_message("assistant", ''.join(parts)))
+            session['messages'] = messages
+            _persist_session(current_app, session)
+            
+            yield b"event: done\ndata: {}\n\n"
+        
+        return Response(stream_with_context(generate()), mimetype='text/event-stream')
         
     except Exception as e:
         return jsonify({
@@ -208,7 +462,7 @@ def get_history():
         
         return jsonify({
             'success': True,
-            'messages': messages
+            'messages': [{'role': msg['role'], 'content': msg['content']} for msg in messages]
         }), 200
         
     except Exception as e:
@@ -225,6 +479,10 @@ def clear_history():
         init_session()
         session['messages'] = []
         
+        db_config = session.get('db_config')
+        if db_config:
+            invalidate_cached_responses(db_config)
+        
         return jsonify({
             'success': True,
             'message': 'Chat history cleared'
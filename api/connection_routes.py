@@ -1,11 +1,27 @@
 """
 Database connection API routes
 """
-from flask import Blueprint, request, jsonify, session
-from utils import test_connection, init_session
+import logging
+import threading
+from flask import Blueprint, current_app, request, jsonify, session
+from utils import (
+    test_connection, init_session, get_cached_schema_info,
+    invalidate_cached_responses, build_history_message
+)
 
 connection_bp = Blueprint('connection', __name__)
 
+logger = logging.getLogger(__name__)
+
+
+def _warm_up(app, db_config: dict):
+    """Load the schema before the first question (the pool is warm after the test)"""
+    try:
+        with app.app_context():
+            get_cached_schema_info(db_config)
+    except Exception as e:
+        logger.warning("Schema warm-up failed: %s", e)
+
 
 @connection_bp.route('/api/connect', methods=['POST'])
 def connect():
@@ -30,7 +46,8 @@ def connect():
             'database': data['database']
         }
         
-        # Test connection
+        # Test connection (which also opens the first pooled connection); the
+        # driver's connect timeout bounds how long an unreachable host takes
         success, message = test_connection(db_config)
         
         if not success:
@@ -56,10 +73,13 @@ def connect():
             welcome_msg += f"\n\n🎯 **Active Directive:** {directive[:100]}..."
         welcome_msg += "\n\nAsk me anything about your data!"
         
-        session['messages'] = [{
-            "role": "assistant",
-            "content": welcome_msg
-        }]
+        session['messages'] = [build_history_message("assistant", welcome_msg)]
+        
+        # Schema is loaded in the background while the user types
+        threading.Thread(
+            target=_warm_up, args=(current_app._get_current_object(), db_config),
+            name='db-warm-up', daemon=True
+        ).start()
         
         return jsonify({
             'success': True,
@@ -80,6 +100,12 @@ def connect():
 def disconnect():
     """Disconnect from database"""
     try:
+        # Cached answers for the database are dropped; the shared engine may
+        # still be serving other sessions and is left to its own lifecycle
+        db_config = session.get('db_config')
+        if db_config:
+            invalidate_cached_responses(db_config)
+        
         session['db_config'] = None
         session['db_connected'] = False
         session['chatbot_directive'] = None
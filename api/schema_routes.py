@@ -2,7 +2,7 @@
 Database schema API routes
 """
 from flask import Blueprint, jsonify, session
-from utils import init_session, get_database_schema_info
+from utils import init_session, get_cached_schema_info, refresh_db_chain, invalidate_cached_responses
 
 schema_bp = Blueprint('schema', __name__)
 
@@ -25,7 +25,7 @@ def get_schema():
         db_config = session.get('db_config')
         
         if not schema_info:
-            schema_info = get_database_schema_info(db_config)
+            schema_info = get_cached_schema_info(db_config)
             session['schema_cache'] = schema_info
         
         return jsonify({
@@ -38,3 +38,38 @@ def get_schema():
             'success': False,
             'message': f'Error getting schema: {str(e)}'
         }), 500
+
+
+@schema_bp.route('/api/schema/refresh', methods=['POST'])
+def refresh_schema():
+    """Re-inspect the database and replace the cached schema"""
+    try:
+        init_session()
+        
+        # Check if database is connected
+        if not session.get('db_connected', False):
+            return jsonify({
+                'success': False,
+                'message': 'Please connect to a database first'
+            }), 400
+        
+        # The shared SQLDatabase holds the old table list; rebuild it too
+        # (on the same engine, which other sessions may be using)
+        db_config = session.get('db_config')
+        refresh_db_chain(db_config)
+        # Answers cached against the old schema may no longer hold
+        invalidate_cached_responses(db_config)
+        schema_info = get_cached_schema_info(db_config, refresh=True)
+        session['schema_cache'] = schema_info
+        
+        return jsonify({
+            'success': True,
+            'message': 'Schema refreshed successfully',
+            'schema': schema_info
+        }), 200
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error refreshing schema: {str(e)}'
+        }), 500
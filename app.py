@@ -2,28 +2,55 @@
 Flask Application - SQL Chatbot with API
 Main entry point for the application
 """
+import logging
 import os
+import orjson
 from flask import Flask, render_template
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from flask_session import Session
-from flask_caching import Cache
 from config import config
+from extensions import cache
 
 # Import API blueprints
 from api import connection_bp, directive_bp, chat_bp, schema_bp
 
 
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson for request parsing and jsonify"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS),
+            mimetype=self.mimetype
+        )
+
+
 def create_app(config_name='development'):
     """Application factory pattern"""
     app = Flask(__name__)
+    app.json = OrjsonProvider(app)
     
     # Load configuration
     app.config.from_object(config[config_name])
     
+    # Configure logging once; pipeline debug output only in debug mode
+    logging.basicConfig(
+        level=logging.DEBUG if app.config['DEBUG'] else logging.INFO,
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+    )
+    
     # Initialize extensions
     CORS(app, resources={r"/api/*": {"origins": app.config['CORS_ORIGINS']}})
     Session(app)
-    cache = Cache(app)
+    cache.init_app(app)
     
     # Create session directory if it doesn't exist
     if not os.path.exists(app.config['SESSION_FILE_DIR']):
@@ -1,28 +1,53 @@
 import os
+from cachelib import FileSystemCache, SimpleCache
 from dotenv import load_dotenv
 
 load_dotenv()
 
+REDIS_URL = os.getenv('REDIS_URL')
+
+
 class Config:
     """Base configuration"""
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
     
-    # Session configuration
-    SESSION_TYPE = 'filesystem'
+    # Session configuration: Redis when REDIS_URL is set, otherwise cachelib
+    SESSION_TYPE = 'redis' if REDIS_URL else 'cachelib'
     SESSION_PERMANENT = False
     SESSION_USE_SIGNER = True
+    SESSION_REFRESH_EACH_REQUEST = False  # Only write sessions that changed
     SESSION_FILE_DIR = os.path.join(os.getcwd(), 'flask_session')
+    SESSION_CACHELIB = FileSystemCache(SESSION_FILE_DIR, threshold=500)
+    if REDIS_URL:
+        from redis import Redis
+        SESSION_REDIS = Redis.from_url(REDIS_URL)
     
     # CORS configuration
     CORS_ORIGINS = ['http://localhost:5000', 'http://127.0.0.1:5000']
     
-    # Cache configuration
-    CACHE_TYPE = 'simple'
+    # Cache configuration (filesystem-backed so all workers share entries)
+    CACHE_TYPE = 'FileSystemCache'
+    CACHE_DIR = os.path.join(os.getcwd(), 'flask_cache')
     CACHE_DEFAULT_TIMEOUT = 300
+    SCHEMA_CACHE_TIMEOUT = 3600
+    
+    # Include a few sample rows per table in the schema prompt (one query per table)
+    SCHEMA_SAMPLE_DATA = os.getenv('SCHEMA_SAMPLE_DATA', 'true').lower() != 'false'
     
     # Groq API
     GROQ_API_KEY = os.getenv('GROQ_API_KEY')
     
+    # On a failed query, hand the question to the LangChain SQL agent (up to 10
+    # LLM calls) instead of one repair attempt
+    SQL_AGENT_FALLBACK = os.getenv('SQL_AGENT_FALLBACK', 'false').lower() == 'true'
+    
+    # Most rows read from a generated query and passed on to the answer
+    MAX_RESULT_ROWS = int(os.getenv('MAX_RESULT_ROWS', 200))
+    
+    # Refuse questions whose best embedding similarity to the schema is below
+    # this, before any LLM call (0 disables; requires fastembed, e.g. 0.28)
+    SCOPE_CHECK_THRESHOLD = float(os.getenv('SCOPE_CHECK_THRESHOLD', 0))
+    
     # Application settings
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max request size
 
@@ -31,6 +56,8 @@ class DevelopmentConfig(Config):
     """Development configuration"""
     DEBUG = True
     TESTING = False
+    # Single dev process: keep sessions in memory, no disk round-trip per request
+    SESSION_CACHELIB = SimpleCache(threshold=500)
 
 
 class ProductionConfig(Config):
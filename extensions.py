@@ -0,0 +1,6 @@
+"""
+Flask extension instances shared across blueprints and utilities
+"""
+from flask_caching import Cache
+
+cache = Cache()
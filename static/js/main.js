@@ -132,8 +132,13 @@ async function handleSendMessage() {
     chatInput.disabled = true;
     sendBtn.disabled = true;
     
+    // Placeholder bubble until the first part of the answer arrives
+    const contentDiv = addMessage('', 'assistant');
+    contentDiv.classList.add('thinking');
+    contentDiv.textContent = 'Thinking…';
+    
     try {
-        const response = await fetch('/api/chat', {
+        const response = await fetch('/api/chat/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -141,16 +146,48 @@ async function handleSendMessage() {
             body: JSON.stringify({ message })
         });
         
-        const data = await response.json();
-        
-        if (data.success) {
-            addMessage(data.response, 'assistant');
-        } else {
+        // Errors come back as regular JSON responses
+        if (!response.ok) {
+            const data = await response.json();
+            contentDiv.parentElement.remove();
             showToast(data.message, 'error');
+            return;
         }
+        
+        // Render the answer as server-sent events arrive
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let answer = '';
+        
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            
+            events.forEach(event => {
+                if (event.startsWith('data: ')) {
+                    const payload = JSON.parse(event.slice(6));
+                    if (payload.delta) {
+                        answer += payload.delta;
+                        contentDiv.classList.remove('thinking');
+                        scheduleRender(contentDiv, () => answer);
+                    }
+                }
+            });
+        }
+        
+        // Make sure the final text is rendered even if no frame fired since
+        contentDiv.classList.remove('thinking');
+        renderContent(contentDiv, answer);
+        chatMessages.scrollTop = chatMessages.scrollHeight;
     } catch (error) {
         showToast('Error sending message: ' + error.message, 'error');
-        addMessage('Sorry, I encountered an error processing your message. Please try again.', 'assistant');
+        contentDiv.classList.remove('thinking');
+        renderContent(contentDiv, 'Sorry, I encountered an error processing your message. Please try again.');
     } finally {
         chatInput.disabled = false;
         sendBtn.disabled = false;
@@ -167,10 +204,14 @@ async function loadChatHistory() {
         const data = await response.json();
         
         if (data.success && data.messages.length > 0) {
-            clearMessages();
+            // Build the whole history off-DOM, then attach and scroll once
+            const fragment = document.createDocumentFragment();
             data.messages.forEach(msg => {
-                addMessage(msg.content, msg.role);
+                fragment.appendChild(createMessageElement(msg.content, msg.role).messageDiv);
             });
+            clearMessages();
+            chatMessages.appendChild(fragment);
+            chatMessages.scrollTop = chatMessages.scrollHeight;
             clearChatBtn.style.display = 'block';
         }
     } catch (error) {
@@ -250,7 +291,7 @@ function updateUIForDisconnected() {
     clearChatBtn.style.display = 'none';
 }
 
-function addMessage(content, role) {
+function createMessageElement(content, role) {
     const messageDiv = document.createElement('div');
     messageDiv.className = `message message-${role}`;
     
@@ -260,20 +301,45 @@ function addMessage(content, role) {
     
     const contentDiv = document.createElement('div');
     contentDiv.className = 'message-content';
-    
-    // Use marked.js to render markdown
-    if (typeof marked !== 'undefined') {
-        contentDiv.innerHTML = marked.parse(content);
-    } else {
-        contentDiv.textContent = content;
-    }
+    renderContent(contentDiv, content);
     
     messageDiv.appendChild(avatar);
     messageDiv.appendChild(contentDiv);
+    
+    return { messageDiv, contentDiv };
+}
+
+function addMessage(content, role) {
+    const { messageDiv, contentDiv } = createMessageElement(content, role);
     chatMessages.appendChild(messageDiv);
     
     // Auto scroll to bottom
     chatMessages.scrollTop = chatMessages.scrollHeight;
+    
+    return contentDiv;
+}
+
+// Re-render a streaming message at most once per animation frame, so the
+// growing markdown isn't re-parsed for every delta
+let renderPending = false;
+
+function scheduleRender(contentDiv, getContent) {
+    if (renderPending) return;
+    renderPending = true;
+    requestAnimationFrame(() => {
+        renderPending = false;
+        renderContent(contentDiv, getContent());
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    });
+}
+
+function renderContent(contentDiv, content) {
+    // Use marked.js to render markdown
+    if (typeof marked !== 'undefined') {
+        contentDiv.innerHTML = marked.parse(content);
+    } else {
+        contentDiv.textContent = content;
+    }
 }
 
 function clearMessages() {
@@ -0,0 +1,82 @@
+"""
+Tests for parsing the SQL generator's JSON reply in utils.query_generator
+"""
+import unittest
+
+from utils.query_generator import _JsonObjectScanner, _parse_sql_response
+
+
+def _scan(text):
+    return _JsonObjectScanner().feed(text)
+
+
+class JsonObjectScannerTest(unittest.TestCase):
+    
+    def test_finds_end_of_nested_object(self):
+        text = 'Here you go: {"a": {"b": {"c": 1}}, "d": 2} and more'
+        end = _scan(text)
+        self.assertEqual(text[text.index('{'):end], '{"a": {"b": {"c": 1}}, "d": 2}')
+    
+    def test_braces_inside_strings_are_ignored(self):
+        text = '{"sql_query": "SELECT \'}\' AS x, \'{\' AS y", "confidence": 0.9} {"other": 1}'
+        end = _scan(text)
+        self.assertEqual(text[:end], '{"sql_query": "SELECT \'}\' AS x, \'{\' AS y", "confidence": 0.9}')
+    
+    def test_escaped_quotes_stay_inside_string(self):
+        text = r'{"reasoning": "the \"}\" case \\", "confidence": 1} tail'
+        end = _scan(text)
+        self.assertEqual(text[:end], r'{"reasoning": "the \"}\" case \\", "confidence": 1}')
+    
+    def test_unclosed_object_returns_minus_one(self):
+        scanner = _JsonObjectScanner()
+        self.assertEqual(scanner.feed('prefix {"a": "}"'), -1)
+        self.assertEqual(scanner.start, 7)
+    
+    def test_chunked_feed_matches_single_feed(self):
+        text = r'ok {"sql_query": "SELECT \"{\" FROM t", "n": {"m": 2}} trailing'
+        expected = _scan(text)
+        # Split everywhere, including right after a backslash inside a string
+        for size in (1, 2, 3, 5, 8):
+            with self.subTest(size=size):
+                scanner = _JsonObjectScanner()
+                end = -1
+                for offset in range(0, len(text), size):
+                    end = scanner.feed(text[offset:offset + size], offset)
+                    if end != -1:
+                        break
+                self.assertEqual(end, expected)
+                self.assertEqual(scanner.start, 3)
+
+
+class ParseSqlResponseTest(unittest.TestCase):
+    
+    def test_whole_reply_object(self):
+        result = _parse_sql_response('{"sql_query": "SELECT 1", "confidence": 0.8, "tables_used": []}')
+        self.assertEqual(result['sql_query'], "SELECT 1")
+        self.assertEqual(result['confidence'], 0.8)
+    
+    def test_object_with_trailing_prose(self):
+        reply = 'Sure!\n{"sql_query": "SELECT name FROM users", "confidence": 0.9}\nLet me know if {more} helps.'
+        result = _parse_sql_response(reply)
+        self.assertEqual(result['sql_query'], "SELECT name FROM users")
+    
+    def test_skips_objects_that_do_not_parse(self):
+        reply = 'Schema {users} noted. {"sql_query": "SELECT 1", "confidence": "0.7"}'
+        result = _parse_sql_response(reply)
+        self.assertEqual(result['sql_query'], "SELECT 1")
+        self.assertEqual(result['confidence'], 0.7)
+    
+    def test_field_types_are_coerced(self):
+        result = _parse_sql_response('{"sql_query": 5, "confidence": "high", "tables_used": "users"}')
+        self.assertIsNone(result['sql_query'])
+        self.assertEqual(result['confidence'], 0.0)
+        self.assertEqual(result['tables_used'], [])
+    
+    def test_no_object_gives_empty_result(self):
+        result = _parse_sql_response("I cannot answer that")
+        self.assertIsNone(result['sql_query'])
+        self.assertEqual(result['confidence'], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
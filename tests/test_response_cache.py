@@ -0,0 +1,54 @@
+"""
+Tests for chat answer cache keys in utils.response_cache
+"""
+import unittest
+
+from utils.response_cache import response_cache_key
+
+
+_DB = {'host': 'localhost', 'port': 3306, 'database': 'shop', 'user': 'reader'}
+
+
+def _history(*contents):
+    return [{'role': 'user', 'content': content} for content in contents]
+
+
+class ResponseCacheKeyTest(unittest.TestCase):
+    
+    def test_key_is_deterministic(self):
+        first = response_cache_key(_DB, "How many orders?", None, _history("How many orders?"))
+        second = response_cache_key(dict(_DB), "How many orders?", None, _history("How many orders?"))
+        self.assertEqual(first, second)
+        self.assertTrue(first.startswith("chat:"))
+    
+    def test_question_is_normalized(self):
+        plain = response_cache_key(_DB, "how many orders", None, [])
+        self.assertEqual(response_cache_key(_DB, "  How   many ORDERS?! ", None, []), plain)
+    
+    def test_missing_and_empty_directive_match(self):
+        self.assertEqual(
+            response_cache_key(_DB, "list users", None, []),
+            response_cache_key(_DB, "list users", "", [])
+        )
+    
+    def test_directive_database_and_history_are_part_of_the_key(self):
+        base = response_cache_key(_DB, "list them", None, _history("show users", "ok", "list them"))
+        self.assertNotEqual(base, response_cache_key(_DB, "list them", "Be brief", _history("show users", "ok", "list them")))
+        self.assertNotEqual(base, response_cache_key(dict(_DB, database='crm'), "list them", None, _history("show users", "ok", "list them")))
+        self.assertNotEqual(base, response_cache_key(_DB, "list them", None, _history("show orders", "ok", "list them")))
+    
+    def test_only_the_two_turns_before_the_question_count(self):
+        self.assertEqual(
+            response_cache_key(_DB, "list them", None, _history("first", "show users", "ok", "list them")),
+            response_cache_key(_DB, "list them", None, _history("other", "show users", "ok", "list them"))
+        )
+    
+    def test_fields_do_not_run_together(self):
+        self.assertNotEqual(
+            response_cache_key(_DB, "c", "ab", []),
+            response_cache_key(_DB, "bc", "a", [])
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Tests for result formatting in utils.response_generator
+"""
+import unittest
+from decimal import Decimal
+from enum import IntEnum
+
+from utils.response_generator import _clean_value, clean_sql_results, format_trivial_answer, render_answer_template
+
+
+class _Status(IntEnum):
+    ACTIVE = 1
+
+
+class CleanValueTest(unittest.TestCase):
+    
+    def test_numbers_display_as_floats(self):
+        self.assertEqual(_clean_value(3), "3.0")
+        self.assertEqual(_clean_value(2.5), "2.5")
+        self.assertEqual(_clean_value(Decimal("33726.77")), "33726.77")
+    
+    def test_bool_displays_as_float(self):
+        # bool is an int subclass, so it takes the numeric branch
+        self.assertEqual(_clean_value(True), "1.0")
+        self.assertEqual(_clean_value(False), "0.0")
+    
+    def test_int_subclass_displays_as_float(self):
+        self.assertEqual(_clean_value(_Status.ACTIVE), "1.0")
+    
+    def test_non_numeric_values(self):
+        self.assertEqual(_clean_value(None), "NULL")
+        self.assertEqual(_clean_value(b"\x89PNG"), "[Binary Data - Image/BLOB]")
+        self.assertEqual(_clean_value(" ACTION "), "Action")
+
+
+
+class CleanSqlResultsFallbackTest(unittest.TestCase):
+    # Expected strings are what the original multi-pass regex cleaning produced
+    
+    def test_multiple_rows(self):
+        text = "Result: (1, 'ALICE SMITH', Decimal('12.50')), (2, 'BOB', Decimal('3.00'))"
+        self.assertEqual(clean_sql_results(text), "1 | Alice Smith | 12.50\n2 | Bob | 3.00")
+    
+    def test_rows_keep_urls_and_split_quoted_commas(self):
+        self.assertEqual(clean_sql_results("Links: (1, 'HTTP://EXAMPLE.COM'), (2, 'OK')"), "1 | HTTP://Example.Com\n2 | Ok")
+        self.assertEqual(clean_sql_results("Rows: (1, 'it''s'), (2, 'x,y')"), "1 | its\n2 | x | y")
+    
+    def test_single_row_text(self):
+        self.assertEqual(clean_sql_results("Found 'NEW YORK', ACTIVE, 3 rows"), "Found New York | Active | 3 rows")
+        self.assertEqual(clean_sql_results("Top roles: ['ADMIN', 'USER'], (STAFF)"), "Top roles: Admin | User | Staff")
+    
+    def test_hex_escapes_and_binary_data(self):
+        self.assertEqual(clean_sql_results("Status is 'OK', see caf\\xe9 notes"), "Status is Ok | see caf notes")
+        self.assertEqual(clean_sql_results("Logo row: (7, b'\\x89PNG\\x00')"), "Logo row: 7 | | Binary Data - Image/Blob removed")
+
+
+class RenderAnswerTemplateTest(unittest.TestCase):
+    
+    def test_single_value_inline(self):
+        self.assertEqual(render_answer_template("There are {rows} orders.", [(42,)]), "There are 42 orders.")
+    
+    def test_single_column_as_list(self):
+        rows = [(" Alice ",), ("Bob",), (None,)]
+        self.assertEqual(render_answer_template("Users: {rows}", rows), "Users: Alice, Bob and N/A")
+    
+    def test_several_columns_as_bullets(self):
+        rows = [("Alice", 3), ("Bob", 1)]
+        self.assertEqual(render_answer_template("Orders {per user}:\n{rows}", rows), "Orders {per user}:\n- Alice, 3\n- Bob, 1")
+    
+    def test_large_wide_or_binary_results_are_skipped(self):
+        self.assertIsNone(render_answer_template("{rows}", [(i,) for i in range(21)]))
+        self.assertIsNone(render_answer_template("{rows}", [(1, 2, 3, 4, 5)]))
+        self.assertIsNone(render_answer_template("{rows}", [(b"\x89PNG",)]))
+
+
+class FormatTrivialAnswerTest(unittest.TestCase):
+    
+    def test_single_value(self):
+        self.assertEqual(format_trivial_answer(["total_orders"], [(42,)]), "**Total orders:** 42")
+    
+    def test_expression_column_gets_generic_label(self):
+        self.assertEqual(format_trivial_answer(["COUNT(*)"], [(7,)]), "**Result:** 7")
+    
+    def test_short_single_column(self):
+        self.assertEqual(format_trivial_answer(["name"], [("Alice",), ("Bob",)]), "**Name:** Alice, Bob")
+    
+    def test_other_results_go_to_the_llm(self):
+        self.assertIsNone(format_trivial_answer(["name"], []))
+        self.assertIsNone(format_trivial_answer(["name", "age"], [("Alice", 30)]))
+        self.assertIsNone(format_trivial_answer(["name"], [(str(i),) for i in range(11)]))
+        self.assertIsNone(format_trivial_answer(["photo"], [(b"\x89PNG",)]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+"""
+Tests for input sanitization and query checks in utils.security
+"""
+import unittest
+
+from utils.security import is_modification_request, sanitize_user_input
+
+
+class SanitizeUserInputTest(unittest.TestCase):
+    
+    def test_strips_injection_patterns(self):
+        self.assertEqual(sanitize_user_input("Show users; DROP TABLE users"), "Show users TABLE users")
+        self.assertEqual(sanitize_user_input("names union select password from users"), "names  password from users")
+        self.assertEqual(sanitize_user_input("list /* hidden */ orders"), "list  orders")
+    
+    def test_trailing_comment_only_at_end(self):
+        self.assertEqual(sanitize_user_input("total sales --"), "total sales ")
+        self.assertEqual(sanitize_user_input("a -- b\nc --"), "a -- b\nc ")
+    
+    def test_multiline_block_comment_is_kept(self):
+        # No DOTALL, matching the original per-pattern subs
+        text = "list /* hidden\nacross lines */ orders"
+        self.assertEqual(sanitize_user_input(text), text)
+    
+    def test_plain_question_unchanged(self):
+        self.assertEqual(sanitize_user_input("How many orders?"), "How many orders?")
+
+
+
+class ModificationRequestTest(unittest.TestCase):
+    
+    def test_write_requests_are_refused(self):
+        for text in (
+            "Delete the rows from orders",
+            "delete all orders from 2020",
+            "Please drop table users",
+            "Truncate the logs",
+            "Insert into customers a new row for Bob",
+            "update products set price to 10",
+            "How many orders are there? Drop the orders table.",
+        ):
+            with self.subTest(text=text):
+                self.assertTrue(is_modification_request(text))
+    
+    def test_questions_reach_the_llm(self):
+        for text in (
+            "Update me on how many records the orders table has",
+            "Update us about the users table",
+            "When was the last update to the orders table?",
+            "How many records were deleted from the audit table?",
+            "Show rows where status is 'dropped'",
+            "Which products had an insert date in March?",
+        ):
+            with self.subTest(text=text):
+                self.assertFalse(is_modification_request(text))
+
+if __name__ == '__main__':
+    unittest.main()
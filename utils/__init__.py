@@ -1,26 +1,74 @@
 """
 Utility package initialization
 """
-from .security import is_read_only_query, sanitize_user_input
-from .db_manager import create_db_connection, get_db_chain, test_connection
-from .schema_inspector import get_database_schema_info
-from .query_generator import generate_sql_query_with_llm
-from .response_generator import clean_sql_results, generate_natural_language_response
-from .llm_client import get_llm_client, create_sql_agent_fallback
+from .security import is_read_only_query, is_modification_request, sanitize_user_input
+from .db_manager import (
+    create_db_connection, get_engine, get_db_chain, warm_db_chain, refresh_db_chain, run_query, run_query_rows, test_connection
+)
+from .schema_inspector import (
+    get_database_schema_info, get_cached_schema_info, get_db_fingerprint,
+    get_schema_version, select_relevant_tables, build_schema_description, build_schema_blob
+)
+from .query_generator import (
+    build_system_prompt, build_history_message, generate_sql_query_with_llm, agenerate_sql_query_with_llm,
+    repair_sql_query, arepair_sql_query
+)
+from .response_generator import (
+    clean_sql_results, clean_sql_rows, render_answer_template, format_trivial_answer,
+    generate_natural_language_response, agenerate_natural_language_response
+)
+from .llm_client import (
+    get_llm_client, get_sql_llm, get_response_llm, SQL_LLM_SETTINGS, RESPONSE_LLM_SETTINGS,
+    create_sql_agent_fallback
+)
+from .response_cache import (
+    response_cache_key, get_cached_response, cache_response, invalidate_cached_responses
+)
+from .scope_checker import is_out_of_scope
 from .session_manager import get_session_data, update_session, clear_session, init_session
 
 __all__ = [
     'is_read_only_query',
+    'is_modification_request',
     'sanitize_user_input',
     'create_db_connection',
+    'get_engine',
     'get_db_chain',
+    'warm_db_chain',
+    'refresh_db_chain',
+    'run_query',
+    'run_query_rows',
     'test_connection',
     'get_database_schema_info',
+    'get_cached_schema_info',
+    'get_db_fingerprint',
+    'get_schema_version',
+    'select_relevant_tables',
+    'build_schema_description',
+    'build_schema_blob',
+    'build_system_prompt',
+    'build_history_message',
     'generate_sql_query_with_llm',
+    'agenerate_sql_query_with_llm',
+    'repair_sql_query',
+    'arepair_sql_query',
     'clean_sql_results',
+    'clean_sql_rows',
+    'render_answer_template',
+    'format_trivial_answer',
     'generate_natural_language_response',
+    'agenerate_natural_language_response',
     'get_llm_client',
+    'get_sql_llm',
+    'get_response_llm',
+    'SQL_LLM_SETTINGS',
+    'RESPONSE_LLM_SETTINGS',
     'create_sql_agent_fallback',
+    'response_cache_key',
+    'get_cached_response',
+    'cache_response',
+    'invalidate_cached_responses',
+    'is_out_of_scope',
     'get_session_data',
     'update_session',
     'clear_session',
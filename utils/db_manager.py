@@ -1,38 +1,242 @@
 """
 Database connection and management utilities
 """
-import mysql.connector
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import TYPE_CHECKING
 from urllib.parse import quote_plus
-from sqlalchemy import create_engine
-from langchain_community.utilities import SQLDatabase
 
+# MySQL drivers, SQLAlchemy and LangChain are imported where they are used
+# so app startup doesn't pay for them until a database is actually touched
+if TYPE_CHECKING:
+    from langchain_community.utilities import SQLDatabase
 
-def create_db_connection(db_config: dict):
-    """Create MySQL database connection"""
+# One pooled engine per connection target, shared by all requests; the least
+# recently used targets beyond this are disposed, since each engine can hold
+# up to 30 connections
+_MAX_ENGINES = 16
+_engines = OrderedDict()
+
+# SQLDatabase per target, built on its engine the first time LangChain needs
+# it (it reflects the table list when created); dropped with the engine
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def _config_key(db_config: dict) -> tuple:
+    return (
+        db_config['host'], db_config.get('port', 3306), db_config['user'],
+        db_config['password'], db_config['database']
+    )
+
+
+# SQLAlchemy MySQL driver for queries: "mysqldb" (mysqlclient, C extension,
+# decodes rows much faster) or "mysqlconnector" (pure Python). Unset picks
+# mysqlclient when it is installed
+MYSQL_DRIVER = os.getenv("MYSQL_DRIVER", "")
+
+
+@lru_cache(maxsize=1)
+def _mysql_driver() -> str:
+    if MYSQL_DRIVER:
+        return MYSQL_DRIVER
     try:
-        return mysql.connector.connect(**db_config)
-    except mysql.connector.Error as err:
-        raise Exception(f"Database connection error: {err}")
+        import MySQLdb  # noqa: F401
+    except ImportError:
+        return "mysqlconnector"
+    return "mysqldb"
+
+
+# Seconds the driver waits to open a connection before failing, so an
+# unreachable host fails a connection test quickly instead of blocking its
+# thread for the full TCP timeout
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", 10))
+
 
+def _connect_args() -> dict:
+    """Driver connect arguments; the two drivers name the timeout differently"""
+    if _mysql_driver() == "mysqldb":
+        return {'connect_timeout': DB_CONNECT_TIMEOUT}
+    return {'connection_timeout': DB_CONNECT_TIMEOUT}
 
-def get_db_chain(db_config: dict) -> SQLDatabase:
-    """Create SQLAlchemy database connection for LangChain"""
+
+@lru_cache(maxsize=16)
+def _build_uri(host: str, port: int, user: str, password: str, database: str) -> str:
+    """SQLAlchemy URI for a connection target, in _config_key order"""
+    return f"mysql+{_mysql_driver()}://{user}:{quote_plus(password)}@{host}:{port}/{database}"
+
+
+def _create_engine(db_config: dict):
+    """Pooled SQLAlchemy engine for db_config"""
+    from sqlalchemy import create_engine
+    
+    return create_engine(
+        _build_uri(*_config_key(db_config)),
+        connect_args=_connect_args(),
+        pool_size=10,
+        max_overflow=20,
+        pool_pre_ping=True,
+        pool_recycle=1800
+    )
+
+
+def get_engine(db_config: dict):
+    """
+    Get the shared pooled SQLAlchemy engine for db_config
+    Creating one doesn't connect; the first checkout does
+    """
+    key = _config_key(db_config)
+    with _databases_lock:
+        engine = _engines.get(key)
+        if engine is not None:
+            _engines.move_to_end(key)
+            return engine
+    
+    engine = _create_engine(db_config)
+    evicted = None
+    with _databases_lock:
+        # Another request may have built one meanwhile; keep the first
+        existing = _engines.setdefault(key, engine)
+        if existing is engine and len(_engines) > _MAX_ENGINES:
+            evicted_key, evicted = _engines.popitem(last=False)
+            _databases.pop(evicted_key, None)
+    if existing is not engine:
+        engine.dispose()
+    if evicted is not None:
+        # Closes its idle connections; a session still holding it gets fresh
+        # ones, as dispose leaves the engine usable
+        evicted.dispose()
+    return existing
+
+
+def _discard_engine(db_config: dict, engine):
+    """Forget and dispose engine, if it is still the one cached for db_config"""
+    key = _config_key(db_config)
+    with _databases_lock:
+        if _engines.get(key) is not engine:
+            return
+        del _engines[key]
+        _databases.pop(key, None)
+    engine.dispose()
+
+
+def get_db_chain(db_config: dict) -> "SQLDatabase":
+    """
+    Get the shared SQLAlchemy database connection for LangChain
+    Built once per connection target on the shared engine; SQLDatabase
+    reflects the table list when created, so reuse also skips that round-trip
+    """
+    from langchain_community.utilities import SQLDatabase
+    
+    engine = get_engine(db_config)
+    key = _config_key(db_config)
+    with _databases_lock:
+        db = _databases.get(key)
+    if db is not None and db._engine is engine:
+        return db
+    
     try:
-        db_uri = f"mysql+mysqlconnector://{db_config['user']}:{quote_plus(db_config['password'])}@{db_config['host']}/{db_config['database']}"
-        engine = create_engine(db_uri)
-        return SQLDatabase(engine=engine)
+        db = SQLDatabase(engine=engine)
     except Exception as e:
         raise Exception(f"Failed to create database chain: {e}")
+    with _databases_lock:
+        # Another request may have built one meanwhile; keep the first
+        existing = _databases.get(key)
+        if existing is not None and existing._engine is engine:
+            return existing
+        _databases[key] = db
+    return db
+
+
+def create_db_connection(db_config: dict):
+    """
+    Create MySQL database connection
+    A DB-API connection checked out of the shared engine's pool; close()
+    returns it to the pool
+    """
+    try:
+        return get_engine(db_config).raw_connection()
+    except Exception as err:
+        raise Exception(f"Database connection error: {err}")
+
+
+def warm_db_chain(db_config: dict):
+    """
+    Open the shared engine's first pooled connection ahead of the first
+    question, so that question skips the connect and auth round-trips
+    An unreachable target's engine is discarded rather than kept cached
+    """
+    from sqlalchemy import text
+    
+    engine = get_engine(db_config)
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception:
+        _discard_engine(db_config, engine)
+        raise
+
+
+def refresh_db_chain(db_config: dict) -> "SQLDatabase":
+    """
+    Replace the shared SQLDatabase for db_config with one that reflects the
+    current table list
+    The engine and its pool are reused, not disposed: other sessions on the
+    same target keep running queries through them
+    """
+    with _databases_lock:
+        _databases.pop(_config_key(db_config), None)
+    return get_db_chain(db_config)
+
+
+def run_query(db: "SQLDatabase", sql_query: str, max_rows: int = None) -> tuple[list[str], list[tuple]]:
+    """
+    Execute a query and return its column names and rows as tuples
+    Skips SQLDatabase.run's string rendering, so results need no re-parsing.
+    With max_rows, the server itself stops at the cap (sql_select_limit on
+    the checked-out connection), so no driver transfers or buffers more than
+    that; mysqlclient additionally streams the rows. A LIMIT in the query
+    overrides sql_select_limit, so reading also stops at the cap.
+    """
+    with db._engine.connect() as conn:
+        # Generated SQL has no bound parameters; this keeps drivers from
+        # %-formatting it (mysqlclient would choke on LIKE '%...%')
+        conn = conn.execution_options(no_parameters=True)
+        if max_rows is None:
+            result = conn.exec_driver_sql(sql_query)
+            return list(result.keys()), [tuple(row) for row in result.fetchall()]
+        
+        # mysql.connector buffers whole results and ignores stream_results,
+        # so the cap has to be applied by the server
+        conn.exec_driver_sql(f"SET SESSION sql_select_limit = {int(max_rows)}")
+        try:
+            result = conn.execution_options(stream_results=True).exec_driver_sql(sql_query)
+            try:
+                return list(result.keys()), [tuple(row) for row in result.fetchmany(max_rows)]
+            finally:
+                result.close()
+        finally:
+            # Pooled connections are shared; don't hand the limit to the next user
+            conn.exec_driver_sql("SET SESSION sql_select_limit = DEFAULT")
+
+
+def run_query_rows(db: "SQLDatabase", sql_query: str, max_rows: int = None) -> list[tuple]:
+    """Rows of run_query, without the column names"""
+    return run_query(db, sql_query, max_rows)[1]
 
 
 def test_connection(db_config: dict) -> tuple[bool, str]:
     """
     Test database connection
+    A SELECT 1 through the shared engine, so a successful test leaves a
+    pooled connection ready for the first question; the table reflection
+    of SQLDatabase waits until LangChain needs it
     Returns: (success, message)
     """
     try:
-        conn = mysql.connector.connect(**db_config)
-        conn.close()
+        warm_db_chain(db_config)
         return True, f"Successfully connected to {db_config['database']}"
-    except mysql.connector.Error as err:
+    except Exception as err:
         return False, f"Connection failed: {err}"
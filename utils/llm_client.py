@@ -2,36 +2,116 @@
 LLM client initialization and management
 """
 import os
-from langchain_groq import ChatGroq
-from langchain_community.agent_toolkits.sql.base import create_sql_agent
-from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
-import langchain
-from langchain_community.cache import InMemoryCache
+import threading
+from functools import lru_cache
 
-# Initialize cache
-langchain.llm_cache = InMemoryCache()
 
+# SQLite file backing LangChain's LLM cache, shared by all workers and kept
+# across restarts; set LLM_CACHE_PATH empty for a per-process in-memory cache
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(".cache", "langchain.sqlite"))
 
-def get_llm_client(temperature: float = 0.3):
-    """Get configured Groq LLM client"""
+
+def _init_llm_cache():
+    """Install LangChain's LLM cache (once, on first client creation)"""
+    import langchain
+    
+    if langchain.llm_cache is not None:
+        return
+    
+    if LLM_CACHE_PATH:
+        from langchain_community.cache import SQLiteCache
+        
+        os.makedirs(os.path.dirname(LLM_CACHE_PATH) or ".", exist_ok=True)
+        langchain.llm_cache = SQLiteCache(database_path=LLM_CACHE_PATH)
+    else:
+        from langchain_community.cache import InMemoryCache
+        
+        langchain.llm_cache = InMemoryCache()
+
+
+@lru_cache(maxsize=1)
+def _get_http_client():
+    """
+    Shared HTTP connection pool so Groq keep-alive connections persist across chat
+    turns; HTTP/2 lets concurrent requests multiplex over one TLS connection
+    """
+    import httpx
+    
+    return httpx.Client(http2=True, limits=httpx.Limits(max_keepalive_connections=20))
+
+
+@lru_cache(maxsize=8)
+def get_llm_client(temperature: float = 0.3, max_tokens: int = None, json_mode: bool = False):
+    """
+    Get configured Groq LLM client
+    One process-wide instance per setting combination; use its sync API
+    (from a worker thread in async code) since each request runs its own
+    event loop
+    """
     groq_api_key = os.getenv("GROQ_API_KEY")
     if not groq_api_key:
         raise ValueError("GROQ_API_KEY not found in environment variables")
     
+    # Deferred so importing utils doesn't load LangChain at app startup
+    from langchain_groq import ChatGroq
+    _init_llm_cache()
+    
     return ChatGroq(
         model_name="llama-3.3-70b-versatile",
         groq_api_key=groq_api_key,
-        temperature=temperature
+        temperature=temperature,
+        max_tokens=max_tokens,
+        model_kwargs={"response_format": {"type": "json_object"}} if json_mode else {},
+        http_client=_get_http_client()
     )
 
 
+# SQL generation: deterministic JSON, bounded output
+SQL_LLM_SETTINGS = {'temperature': 0.0, 'max_tokens': 512, 'json_mode': True}
+
+# Natural-language answers: a little variety, capped length
+RESPONSE_LLM_SETTINGS = {'temperature': 0.2, 'max_tokens': 400}
+
+
+def get_sql_llm():
+    """Client for SQL generation"""
+    return get_llm_client(**SQL_LLM_SETTINGS)
+
+
+def get_response_llm():
+    """Client for turning query results into answers"""
+    return get_llm_client(**RESPONSE_LLM_SETTINGS)
+
+
+# Guards the per-database agent caches. The agents are kept on the SQLDatabase
+# itself ({id(llm): agent}), since each agent's toolkit holds the database:
+# they are collected together when refresh_db_chain replaces it, which a
+# registry keyed by the database object could never allow
+_sql_agents_lock = threading.Lock()
+
+
 def create_sql_agent_fallback(db, llm):
-    """Create LangChain SQL Agent as fallback"""
-    toolkit = SQLDatabaseToolkit(db=db, llm=llm)
-    return create_sql_agent(
+    """
+    Create LangChain SQL Agent as fallback
+    Built once per database and LLM client, then reused across turns; its
+    query tool returns at most a page of rows per call
+    """
+    with _sql_agents_lock:
+        agents = db.__dict__.setdefault('_chatbot_sql_agents', {})
+        agent = agents.get(id(llm))
+        if agent is not None:
+            return agent
+    
+    from langchain_community.agent_toolkits.sql.base import create_sql_agent
+    from .sql_agent_tools import PagedSQLDatabaseToolkit
+    
+    toolkit = PagedSQLDatabaseToolkit(db=db, llm=llm)
+    agent = create_sql_agent(
         llm=llm,
         toolkit=toolkit,
         verbose=True,
         handle_parsing_errors=True,
         max_iterations=10
     )
+    with _sql_agents_lock:
+        return agents.setdefault(id(llm), agent)
@@ -1,122 +1,23 @@
 """
 SQL query generation using LLM - Core logic preserved from original
 """
+import asyncio
+import hashlib
+import logging
 import re
-import json
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+import orjson
+from .schema_inspector import select_relevant_tables, build_schema_blob, get_schema_version
 
 
-def generate_sql_query_with_llm(user_query: str, schema_info: dict, llm, conversation_history: list = None, custom_directive: str = None) -> dict:
-    """
-    Uses LLM to:
-    1. Understand user intent
-    2. Generate appropriate SQL query
-    3. Explain the reasoning
-    
-    NO hardcoded patterns or templates!
-    """
-    
-    # Build custom directive section if provided
-    directive_section = ""
-    if custom_directive:
-        directive_section = f"""
-{'='*50}
-CUSTOM CHATBOT DIRECTIVE:
-{'='*50}
-{custom_directive}
-
-IMPORTANT: Follow the directive above when interpreting user questions and generating responses.
-This directive defines your role, domain expertise, and behavioral guidelines.
-{'='*50}
-
-"""
-    
-    # Build conversation context
-    context = ""
-    if conversation_history and len(conversation_history) > 1:
-        # Get last 4 exchanges for better context
-        recent_messages = conversation_history[-8:]  # Last 4 Q&A pairs
-        context = "\n" + "="*50 + "\n"
-        context += "CONVERSATION HISTORY (for context resolution):\n"
-        context += "="*50 + "\n"
-        for i, msg in enumerate(recent_messages):
-            role = "User" if msg.get("role") == "user" else "Assistant"
-            # Include more content for assistant responses to capture what was retrieved
-            max_length = 500 if msg.get("role") == "assistant" else 200
-            content = msg.get('content', '')[:max_length]
-            if len(msg.get('content', '')) > max_length:
-                content += "..."
-            context += f"{role}: {content}\n\n"
-        
-        context += """
-🎯 ENHANCED FOLLOW-UP QUESTION DETECTION RULES:
-
-**STEP 1: Determine if this is a FOLLOW-UP or NEW question**
-
-IS A FOLLOW-UP if:
-✅ Uses pronouns referring to previous results: "them", "they", "it", "those", "these", "their"
-✅ Uses relative references: "each", "all of them", "any of them", "the same", "others"
-✅ Asks for MORE details about previous results: "show their details", "what about their...", "how many do they..."
-✅ Comparative questions building on previous: "which one is better", "compared to those"
-✅ Short contextual questions: "how many?", "which ones?", "where?" (when previous context exists)
-✅ Clarifying or drilling down: "for each", "break it down", "by category"
-
-IS A NEW QUESTION if:
-❌ Mentions completely different entities not in previous conversation
-❌ Asks about different tables/concepts entirely (e.g., switching from "films" to "customers")
-❌ Uses specific names/IDs not from previous results
-❌ Complete sentences with full context that don't need history
-❌ Starts with "Show me...", "Find...", "List...", "Get..." with NEW entities
-❌ Question makes complete sense without any conversation history
-
-**STEP 2: Handle based on type**
-
-FOR FOLLOW-UP QUESTIONS:
-1. Extract the entities/IDs from the MOST RECENT assistant response
-2. If assistant listed items (films, actors, customers, etc.), extract those specific items
-3. Build your query to filter/join using those specific entities
-4. Confidence should be NORMAL (0.6-0.9) if you can identify the entities
-5. Confidence should be LOW (0.2-0.4) ONLY if pronouns exist BUT no clear entities in history
+logger = logging.getLogger(__name__)
 
-FOR NEW QUESTIONS:
-1. Treat as completely independent query
-2. Don't try to reference conversation history
-3. Use only the schema and current question
-4. Confidence based purely on question clarity and schema availability
-
-**STEP 3: Special Cases**
-
-AMBIGUOUS CASES (could be either):
-- If unsure, favor treating it as NEW question (safer)
-- Only treat as follow-up if there are CLEAR pronouns or relative references
-- Don't force follow-up context on independent questions
-
-SINGLE-WORD RESPONSES ("yes", "no", "sure"):
-- Check if assistant asked a YES/NO question previously
-- If yes, return confidence = 0.2 and ask for clarification
-- If no question was asked, treat as unclear input
-
-EXAMPLES:
-
-Previous: "Here are the top 5 films..."
-Current: "show me their actors" → FOLLOW-UP (pronoun "their" refers to those 5 films)
-Current: "which actors are in comedy films?" → NEW QUESTION (different context, no pronouns)
-
-Previous: "Found 10 customers..."
-Current: "how many orders does each have?" → FOLLOW-UP ("each" refers to those 10 customers)
-Current: "how many orders are there?" → NEW QUESTION (asking about all orders, not specific to those customers)
-
-Previous: "The film rental rate is $4.99"
-Current: "what about replacement cost?" → FOLLOW-UP (continuing the same film)
-Current: "show me all rental rates" → NEW QUESTION (asking for all films, not just that one)
-
-Previous: "Action films: 50"
-Current: "others?" → FOLLOW-UP (asking about other categories)
-Current: "how many comedy films?" → NEW QUESTION (specific category, doesn't need context)
-
-⚠️ CRITICAL: Don't over-interpret! If a question has full context and doesn't use pronouns, it's likely NEW.
-""" + "="*50 + "\n"
-    
-    prompt = f"""You are an expert SQL query generator. Your task is to convert natural language questions into valid SQL queries based on the provided database schema.
+# Instructions, rules and response format; identical for every database and
+# question, so it leads the system message as a stable cacheable prefix.
+# The schema and directive are appended after it by build_system_prompt.
+_SQL_SYSTEM_PROMPT = """You are an expert SQL query generator. Your task is to convert natural language questions into valid SQL queries based on the provided database schema.
 
 🔒 CRITICAL SECURITY REQUIREMENT:
 **YOU MUST ONLY GENERATE SELECT QUERIES - NO DATA MODIFICATION ALLOWED**
@@ -124,19 +25,11 @@ Current: "how many comedy films?" → NEW QUESTION (specific category, doesn't n
 - If user asks to modify/delete/update/insert data, return confidence = 0.0 and explain this is a read-only chatbot
 - Your purpose is to RETRIEVE and ANALYZE data, not to modify it
 
-{directive_section}
-{schema_info['description']}
-
-RELATIONSHIPS:
-{json.dumps(schema_info['relationships'], indent=2)}
-{context}
-USER QUESTION: "{user_query}"
-
 🔍 CONTEXT AWARENESS & FOLLOW-UP ANALYSIS:
 
 **STEP-BY-STEP APPROACH:**
 
-1. **Read the conversation history above carefully**
+1. **Read the conversation history (sent with the question) carefully**
 2. **Identify if current question is FOLLOW-UP or NEW:**
    - Does it use pronouns (them/they/it/those/these/their)?
    - Does it reference previous results implicitly ("each", "others", "more")?
@@ -232,43 +125,10 @@ CRITICAL MATHEMATICAL CALCULATION RULES:
   -- AGG_FUNCTION(value_col) or AGG_FUNCTION(quantity_col * value_col) from detail_table
   ```
 
-📋 SMART FOLLOW-UP QUERY PATTERNS:
-
-**Pattern 1: Asking about related entities**
-Previous: "Here are 5 action films: A, B, C, D, E"
-Follow-up: "show me their actors" / "who stars in them?"
-→ Extract film names → SELECT actors JOIN films WHERE film.name IN ('A','B','C','D','E')
-
-**Pattern 2: Aggregation on previous results**
-Previous: "Found 10 customers from New York"  
-Follow-up: "how many orders does each have?"
-→ Extract customer IDs/names → SELECT customer, COUNT(orders) WHERE customer IN (...) GROUP BY customer
-
-**Pattern 3: Additional details**
-Previous: "Film X has rental rate $4.99"
-Follow-up: "what about replacement cost?" / "show other details"
-→ Continue with same film → SELECT replacement_cost WHERE film = X
-
-**Pattern 4: Comparative follow-ups**
-Previous: "Action films: 50"
-Follow-up: "what about comedy?" / "others?"
-→ New query on different category (NOT filtered by previous) → SELECT COUNT WHERE category = 'Comedy'
-
-**Pattern 5: Drilling down**
-Previous: "Total sales: $10,000"
-Follow-up: "break it down by category" / "for each month"
-→ Add GROUP BY to similar query → SELECT category, SUM(sales) GROUP BY category
-
-⚠️ **Key Distinction:**
-- "Show THEIR details" = Follow-up (filter by previous entities)
-- "Show ALL details" = New question (don't filter)
-- "How many action films?" = New (specific category mentioned)
-- "How many of them?" = Follow-up (refers to previous results)
-
 IMPORTANT RULES:
 - **ABSOLUTE RULE: Return ONLY SELECT queries - NEVER INSERT, UPDATE, DELETE, DROP, etc.**
 - Return ONLY valid SQL (MySQL syntax)
-- Use table and column names EXACTLY as shown in the schema above
+- Use table and column names EXACTLY as shown in the schema below
 - **CRITICAL**: If the question asks for data that DOES NOT EXIST in any table/column in the schema, return confidence = 0.0 and set sql_query = null
 - **CRITICAL**: If the question asks to MODIFY data in any way, return confidence = 0.0 and explain read-only limitation
 - For text searches, use LIKE with wildcards: WHERE column LIKE '%search_term%'
@@ -312,40 +172,621 @@ ERROR HANDLING:
 - **CRITICAL**: If the question asks to modify data, return confidence = 0.0, sql_query = null, and explain read-only limitation
 - If required columns/tables are not available, DO NOT attempt to generate SQL - return low confidence instead
 
+ANSWER TEMPLATES:
+The query results are inserted into your answer without another model call, so also write the answer now:
+- "answer_template": a friendly natural-language answer containing the placeholder {rows} where the results go
+  * A single value is inserted as-is: "There are {rows} films in the Comedy category."
+  * Several single-column rows are inserted as a list: "These actors appear in the film: {rows}."
+  * Multi-column rows are inserted one per line as bullets, values in SELECT column order, so name the columns: "Here are the top customers (name, total spent):\n{rows}"
+  * Use null when a good answer needs reasoning about the values (comparisons, trends, explanations) rather than just stating them
+- "empty_answer": what to tell the user if the query returns no rows, or null
+
 RESPONSE FORMAT (JSON):
-{{
+{
     "sql_query": "SELECT ... FROM ... WHERE ...",
     "reasoning": "Brief explanation of what this query does and why these tables/columns were chosen",
     "confidence": 0.0-1.0,
-    "tables_used": ["table1", "table2"]
-}}
+    "tables_used": ["table1", "table2"],
+    "answer_template": "... {rows} ..." or null,
+    "empty_answer": "..." or null
+}
+"""
 
-Now generate the SQL query for: "{user_query}"
 
-Return ONLY the JSON response, no other text.
+# Follow-up query patterns, shown only when they match the question.
+# Kept in a stable order so repeated buckets produce identical text.
+_EXAMPLES = {
+    'related_entities': """**Pattern 1: Asking about related entities**
+Previous: "Here are 5 action films: A, B, C, D, E"
+Follow-up: "show me their actors" / "who stars in them?"
+→ Extract film names → SELECT actors JOIN films WHERE film.name IN ('A','B','C','D','E')
+""",
+    'aggregate_previous': """**Pattern 2: Aggregation on previous results**
+Previous: "Found 10 customers from New York"  
+Follow-up: "how many orders does each have?"
+→ Extract customer IDs/names → SELECT customer, COUNT(orders) WHERE customer IN (...) GROUP BY customer
+""",
+    'more_details': """**Pattern 3: Additional details**
+Previous: "Film X has rental rate $4.99"
+Follow-up: "what about replacement cost?" / "show other details"
+→ Continue with same film → SELECT replacement_cost WHERE film = X
+""",
+    'comparative': """**Pattern 4: Comparative follow-ups**
+Previous: "Action films: 50"
+Follow-up: "what about comedy?" / "others?"
+→ New query on different category (NOT filtered by previous) → SELECT COUNT WHERE category = 'Comedy'
+""",
+    'drill_down': """**Pattern 5: Drilling down**
+Previous: "Total sales: $10,000"
+Follow-up: "break it down by category" / "for each month"
+→ Add GROUP BY to similar query → SELECT category, SUM(sales) GROUP BY category
+""",
+}
+
+_FOLLOW_UP_DISTINCTION = """⚠️ **Key Distinction:**
+- "Show THEIR details" = Follow-up (filter by previous entities)
+- "Show ALL details" = New question (don't filter)
+- "How many action films?" = New (specific category mentioned)
+- "How many of them?" = Follow-up (refers to previous results)
+"""
+
+_EXAMPLE_TRIGGERS = (
+    ('related_entities', re.compile(r'\b(?:their|them|they|those|these|its)\b', re.IGNORECASE)),
+    ('aggregate_previous', re.compile(r'\b(?:each|every|how many of)\b', re.IGNORECASE)),
+    ('more_details', re.compile(r'\b(?:what|how) about\b|\b(?:other|more) details?\b|\balso\b', re.IGNORECASE)),
+    ('comparative', re.compile(r'\b(?:what|how) about\b|\b(?:others?|instead|compared?|versus|vs)\b', re.IGNORECASE)),
+    ('drill_down', re.compile(r'\bbreak\w*\b.*\bdown\b|\b(?:by|per|for each)\s+\w+|\bgroup', re.IGNORECASE)),
+)
+
+# Most examples included in one prompt
+_MAX_EXAMPLES = 3
+
+
+def _pick_examples(user_query: str, has_history: bool) -> tuple:
+    """
+    Follow-up patterns relevant to this question, in stable order
+    A question without prior conversation can't be a follow-up, so gets none
+    """
+    if not has_history:
+        return ()
+    return tuple(name for name, pattern in _EXAMPLE_TRIGGERS if pattern.search(user_query))[:_MAX_EXAMPLES]
+
+
+@lru_cache(maxsize=32)
+def _examples_block(example_names: tuple) -> str:
+    """The rendered examples section; only a few dozen combinations exist"""
+    if not example_names:
+        return ""
+    return "".join((
+        "\n📋 SMART FOLLOW-UP QUERY PATTERNS:\n\n",
+        "\n".join(_EXAMPLES[name] for name in example_names),
+        "\n",
+        _FOLLOW_UP_DISTINCTION
+    ))
+
+
+# Formatted system prompts, keyed by (schema version, described tables, directive)
+_SYSTEM_PROMPT_CACHE_SIZE = 64
+_system_prompts = OrderedDict()
+_system_prompts_lock = threading.Lock()
+
+
+def build_system_prompt(schema_info: dict, table_names: list = None, custom_directive: str = None) -> str:
+    """
+    Stable part of the SQL generation prompt: the static instructions followed
+    by the schema and directive
+    Formatted once per schema version, table selection and directive, so every
+    turn sends a byte-identical system message the provider can prefix-cache
+    """
+    key = (get_schema_version(schema_info), tuple(table_names) if table_names is not None else None, custom_directive)
+    with _system_prompts_lock:
+        system_prompt = _system_prompts.get(key)
+        if system_prompt is not None:
+            _system_prompts.move_to_end(key)
+            return system_prompt
+    
+    # Build custom directive section if provided
+    directive_section = ""
+    if custom_directive:
+        directive_section = f"""
+{'='*50}
+CUSTOM CHATBOT DIRECTIVE:
+{'='*50}
+{custom_directive}
+
+IMPORTANT: Follow the directive above when interpreting user questions and generating responses.
+This directive defines your role, domain expertise, and behavioral guidelines.
+{'='*50}
+
 """
     
+    # Schema ahead of the directive: it is shared by every session on this database
+    system_prompt = f"""{_SQL_SYSTEM_PROMPT}
+{build_schema_blob(schema_info, table_names)}{directive_section}"""
+    
+    # The digest should only change with the schema, table selection or directive;
+    # a different one per turn means the provider can't reuse its prefix cache
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Built SQL system prompt: %d chars (static prefix %d), sha256 %s",
+            len(system_prompt), len(_SQL_SYSTEM_PROMPT),
+            hashlib.sha256(system_prompt.encode()).hexdigest()[:12]
+        )
+    
+    with _system_prompts_lock:
+        _system_prompts[key] = system_prompt
+        if len(_system_prompts) > _SYSTEM_PROMPT_CACHE_SIZE:
+            _system_prompts.popitem(last=False)
+    return system_prompt
+
+
+_HISTORY_HEADER = "\n" + "="*50 + "\nCONVERSATION HISTORY (for context resolution):\n" + "="*50 + "\n"
+
+# Opens the user message whenever there is history; a constant, so with the
+# system prompt it forms a stable prefix the provider can cache
+_FOLLOW_UP_RULES = """
+🎯 ENHANCED FOLLOW-UP QUESTION DETECTION RULES:
+
+**STEP 1: Determine if this is a FOLLOW-UP or NEW question**
+
+IS A FOLLOW-UP if:
+✅ Uses pronouns referring to previous results: "them", "they", "it", "those", "these", "their"
+✅ Uses relative references: "each", "all of them", "any of them", "the same", "others"
+✅ Asks for MORE details about previous results: "show their details", "what about their...", "how many do they..."
+✅ Comparative questions building on previous: "which one is better", "compared to those"
+✅ Short contextual questions: "how many?", "which ones?", "where?" (when previous context exists)
+✅ Clarifying or drilling down: "for each", "break it down", "by category"
+
+IS A NEW QUESTION if:
+❌ Mentions completely different entities not in previous conversation
+❌ Asks about different tables/concepts entirely (e.g., switching from "films" to "customers")
+❌ Uses specific names/IDs not from previous results
+❌ Complete sentences with full context that don't need history
+❌ Starts with "Show me...", "Find...", "List...", "Get..." with NEW entities
+❌ Question makes complete sense without any conversation history
+
+**STEP 2: Handle based on type**
+
+FOR FOLLOW-UP QUESTIONS:
+1. Extract the entities/IDs from the MOST RECENT assistant response
+2. If assistant listed items (films, actors, customers, etc.), extract those specific items
+3. Build your query to filter/join using those specific entities
+4. Confidence should be NORMAL (0.6-0.9) if you can identify the entities
+5. Confidence should be LOW (0.2-0.4) ONLY if pronouns exist BUT no clear entities in history
+
+FOR NEW QUESTIONS:
+1. Treat as completely independent query
+2. Don't try to reference conversation history
+3. Use only the schema and current question
+4. Confidence based purely on question clarity and schema availability
+
+**STEP 3: Special Cases**
+
+AMBIGUOUS CASES (could be either):
+- If unsure, favor treating it as NEW question (safer)
+- Only treat as follow-up if there are CLEAR pronouns or relative references
+- Don't force follow-up context on independent questions
+
+SINGLE-WORD RESPONSES ("yes", "no", "sure"):
+- Check if assistant asked a YES/NO question previously
+- If yes, return confidence = 0.2 and ask for clarification
+- If no question was asked, treat as unclear input
+
+EXAMPLES:
+
+Previous: "Here are the top 5 films..."
+Current: "show me their actors" → FOLLOW-UP (pronoun "their" refers to those 5 films)
+Current: "which actors are in comedy films?" → NEW QUESTION (different context, no pronouns)
+
+Previous: "Found 10 customers..."
+Current: "how many orders does each have?" → FOLLOW-UP ("each" refers to those 10 customers)
+Current: "how many orders are there?" → NEW QUESTION (asking about all orders, not specific to those customers)
+
+Previous: "The film rental rate is $4.99"
+Current: "what about replacement cost?" → FOLLOW-UP (continuing the same film)
+Current: "show me all rental rates" → NEW QUESTION (asking for all films, not just that one)
+
+Previous: "Action films: 50"
+Current: "others?" → FOLLOW-UP (asking about other categories)
+Current: "how many comedy films?" → NEW QUESTION (specific category, doesn't need context)
+
+⚠️ CRITICAL: Don't over-interpret! If a question has full context and doesn't use pronouns, it's likely NEW.
+""" + "="*50 + "\n"
+
+
+@lru_cache(maxsize=512)
+def _format_history_entry(role: str, content: str) -> str:
+    """
+    One truncated history line; each message is formatted once and reused
+    on every later turn it stays in the window
+    """
+    # Include more content for assistant responses to capture what was retrieved.
+    # Limits are in UTF-8 bytes, which track tokens better than characters
+    # for non-English text
+    max_bytes = 500 if role == "assistant" else 200
+    label = "User" if role == "user" else "Assistant"
+    encoded = content.encode('utf-8')
+    if len(encoded) > max_bytes:
+        content = encoded[:max_bytes].decode('utf-8', 'ignore') + "..."
+    return f"{label}: {content}\n\n"
+
+
+# Most prompt tokens spent on conversation history, newest turns kept first
+HISTORY_TOKEN_BUDGET = 1024
+
+
+@lru_cache(maxsize=1)
+def _get_tokenizer():
+    """tiktoken encoding when installed, otherwise None (length estimate)"""
     try:
-        response = llm.invoke(prompt)
-        response_text = response.content if hasattr(response, 'content') else str(response)
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=512)
+def _count_tokens(text: str) -> int:
+    tokenizer = _get_tokenizer()
+    if tokenizer is None:
+        # Roughly four characters per token for English text
+        return len(text) // 4 + 1
+    return len(tokenizer.encode(text))
+
+
+def _fit_history(lines, budget: int = HISTORY_TOKEN_BUDGET) -> list:
+    """Newest history lines that fit the token budget, in chronological order"""
+    kept = []
+    for line in reversed(lines):
+        budget -= _count_tokens(line)
+        if budget < 0:
+            break
+        kept.append(line)
+    kept.reverse()
+    return kept
+
+
+@lru_cache(maxsize=128)
+def _render_history(lines: tuple) -> str:
+    """
+    The conversation context block for a window of history lines
+    A window is rendered once; rebuilding the same turn's prompt is a lookup
+    """
+    return "".join((_FOLLOW_UP_RULES, _HISTORY_HEADER, *_fit_history(lines)))
+
+
+def build_history_message(role: str, content: str) -> dict:
+    """
+    Builds a chat history message with its prompt context line precomputed,
+    so later turns reuse it instead of re-truncating the content
+    """
+    return {
+        "role": role,
+        "content": content,
+        "context_line": _format_history_entry(role, content)
+    }
+
+
+# The per-turn user message; only the placeholders vary
+_USER_PROMPT_TEMPLATE = """{context}{examples}
+USER QUESTION: "{question}"
+
+Now generate the SQL query for: "{question}"
+
+Return ONLY the JSON response, no other text.
+"""
+
+
+def _build_sql_messages(user_query: str, schema_info: dict, conversation_history: list = None, custom_directive: str = None) -> list:
+    """
+    Builds the SQL generation messages shared by the sync and async generators
+    The cached system prompt comes first; only history and the question vary per turn
+    """
+    
+    # Build conversation context from up to the last 4 Q&A pairs within the token
+    # budget; the static rules come first so only history and question vary per turn
+    context = ""
+    if conversation_history and len(conversation_history) > 1:
+        context = _render_history(tuple(
+            msg.get('context_line') or _format_history_entry(msg.get('role'), msg.get('content', ''))
+            for msg in conversation_history[-8:]
+        ))
+    
+    
+    # Describe only the tables relevant to this question on wide schemas
+    table_names = select_relevant_tables(user_query, schema_info, conversation_history)
+    system_prompt = build_system_prompt(schema_info, table_names, custom_directive)
+    
+    # Only the follow-up patterns this question resembles
+    examples = _examples_block(_pick_examples(user_query, bool(context)))
+    
+    user_prompt = _USER_PROMPT_TEMPLATE.format(context=context, examples=examples, question=user_query)
+    
+    return [("system", system_prompt), ("human", user_prompt)]
+
+
+# Characters the scanner has to look at; everything in between is skipped
+# by the regex engine instead of a Python-level loop
+_STRUCTURAL_RE = re.compile(r'[{}"]')
+_STRING_SPECIAL_RE = re.compile(r'["\\]')
+
+
+class _JsonObjectScanner:
+    """
+    Finds where the first JSON object in a text ends, in one linear pass
+    Tracks brace depth outside of strings (honouring escapes), and can be
+    fed a streamed reply chunk by chunk without rescanning earlier text
+    """
+    
+    def __init__(self):
+        self.start = -1
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+    
+    def feed(self, text: str, offset: int = 0) -> int:
+        """
+        Scans text, which begins at offset in the whole reply
+        Returns the end offset (exclusive) of the object once its closing
+        brace is seen, otherwise -1
+        """
+        i = 0
+        if self._escaped:
+            # The previous chunk ended with a backslash inside a string
+            if not text:
+                return -1
+            self._escaped = False
+            i = 1
         
-        # Extract JSON from response
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
-            result = json.loads(json_match.group())
+        while True:
+            if self._in_string:
+                match = _STRING_SPECIAL_RE.search(text, i)
+                if match is None:
+                    return -1
+                i = match.end()
+                if match.group() == '"':
+                    self._in_string = False
+                elif i < len(text):
+                    i += 1
+                else:
+                    self._escaped = True
+                    return -1
+            elif self._depth == 0:
+                i = text.find('{', i)
+                if i == -1:
+                    return -1
+                self.start = offset + i
+                self._depth = 1
+                i += 1
+            else:
+                match = _STRUCTURAL_RE.search(text, i)
+                if match is None:
+                    return -1
+                i = match.end()
+                char = match.group()
+                if char == '"':
+                    self._in_string = True
+                elif char == '{':
+                    self._depth += 1
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        return offset + i
+
+
+def _load_object(text: str):
+    """
+    The JSON object in text, or None when it doesn't parse to a dict
+    Fields the pipeline computes with are coerced to their expected types,
+    so e.g. a quoted confidence can't fail a comparison later
+    """
+    try:
+        result = orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return None
+    if not isinstance(result, dict):
+        return None
+    
+    confidence = result.get('confidence', 0.0)
+    if not isinstance(confidence, float):
+        try:
+            result['confidence'] = float(confidence)
+        except (TypeError, ValueError):
+            result['confidence'] = 0.0
+    if not isinstance(result.get('sql_query'), (str, type(None))):
+        result['sql_query'] = None
+    if not isinstance(result.get('tables_used', []), list):
+        result['tables_used'] = []
+    return result
+
+
+def _parse_sql_response(response) -> dict:
+    """
+    Extracts the JSON query description from an LLM response
+    """
+    response_text = response.content if hasattr(response, 'content') else str(response)
+    
+    # JSON mode replies are usually nothing but the object itself
+    result = _load_object(response_text)
+    if result is not None:
+        return result
+    
+    # Otherwise take the first balanced object that parses, skipping past any that don't
+    start = response_text.find('{')
+    while start != -1:
+        scanner = _JsonObjectScanner()
+        end = scanner.feed(response_text[start:], start)
+        if end == -1:
+            break
+        result = _load_object(response_text[start:end])
+        if result is not None:
             return result
-        else:
-            return {
-                "sql_query": None,
-                "reasoning": "Could not generate SQL query",
-                "confidence": 0.0,
-                "tables_used": []
-            }
+        start = response_text.find('{', start + 1)
+    
+    return {
+        "sql_query": None,
+        "reasoning": "Could not generate SQL query",
+        "confidence": 0.0,
+        "tables_used": []
+    }
+
+
+def _uses_json_mode(llm) -> bool:
+    """Whether the client requests JSON object replies (response_format)"""
+    return 'response_format' in (getattr(llm, 'model_kwargs', None) or {})
+
+
+def _request_sql_response(llm, messages) -> dict:
+    """
+    The SQL generation reply as a query description
+    A JSON-mode reply is nothing but the object, so streaming it gains
+    nothing, and providers may reject or degrade streaming in JSON mode;
+    those clients, and clients without streaming, use invoke. Other clients
+    are streamed, and reading stops as soon as the JSON object is complete
+    instead of waiting for any trailing commentary
+    """
+    if not hasattr(llm, 'stream') or _uses_json_mode(llm):
+        return _parse_sql_response(llm.invoke(messages))
+    
+    chunks = iter(llm.stream(messages))
+    parts = []
+    scanner = _JsonObjectScanner()
+    offset = 0
+    for chunk in chunks:
+        text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+        parts.append(text)
+        end = scanner.feed(text, offset)
+        offset += len(text)
+        if end != -1:
+            result = _load_object(''.join(parts)[scanner.start:end])
+            if result is not None:
+                return result
+            break
+    
+    # Unbalanced or unparsable: read the rest and search the whole reply
+    parts.extend(chunk.content if hasattr(chunk, 'content') else str(chunk) for chunk in chunks)
+    return _parse_sql_response(''.join(parts))
+
+
+def _error_result(error: Exception) -> dict:
+    """Fallback query description when the LLM call fails"""
+    logger.error("LLM Query Generation Error: %s", error)
+    return {
+        "sql_query": None,
+        "reasoning": f"Error: {str(error)}",
+        "confidence": 0.0,
+        "tables_used": []
+    }
+
+
+# Generated query descriptions keyed by the exact prompt messages; SQL
+# generation is deterministic, so a repeated turn skips the LLM round-trip
+_SQL_RESULT_CACHE_SIZE = 512
+_sql_results = OrderedDict()
+_sql_results_lock = threading.Lock()
+
+
+def _get_cached_sql_result(messages: list):
+    key = tuple(messages)
+    with _sql_results_lock:
+        result = _sql_results.get(key)
+        if result is None:
+            return None
+        _sql_results.move_to_end(key)
+    return dict(result)
+
+
+def _cache_sql_result(messages: list, result: dict):
+    if not result.get('sql_query'):
+        return
+    with _sql_results_lock:
+        _sql_results[tuple(messages)] = dict(result)
+        if len(_sql_results) > _SQL_RESULT_CACHE_SIZE:
+            _sql_results.popitem(last=False)
+
+
+def generate_sql_query_with_llm(user_query: str, schema_info: dict, llm, conversation_history: list = None, custom_directive: str = None) -> dict:
+    """
+    Uses LLM to:
+    1. Understand user intent
+    2. Generate appropriate SQL query
+    3. Explain the reasoning
+    
+    NO hardcoded patterns or templates!
+    """
+    messages = _build_sql_messages(user_query, schema_info, conversation_history, custom_directive)
+    result = _get_cached_sql_result(messages)
+    if result is not None:
+        return result
+    
+    try:
+        result = _request_sql_response(llm, messages)
+    except Exception as e:
+        return _error_result(e)
+    _cache_sql_result(messages, result)
+    return result
+
+
+async def agenerate_sql_query_with_llm(user_query: str, schema_info: dict, llm, conversation_history: list = None, custom_directive: str = None) -> dict:
+    """
+    Async variant of generate_sql_query_with_llm
+    The blocking call runs in a worker thread so shared clients never bind
+    to a per-request event loop
+    """
+    messages = _build_sql_messages(user_query, schema_info, conversation_history, custom_directive)
+    result = _get_cached_sql_result(messages)
+    if result is not None:
+        return result
+    
+    try:
+        result = await asyncio.to_thread(_request_sql_response, llm, messages)
+    except Exception as e:
+        return _error_result(e)
+    _cache_sql_result(messages, result)
+    return result
+
+
+def _build_repair_messages(user_query: str, failed_sql: str, error: str, schema_info: dict, custom_directive: str = None) -> list:
+    """
+    Messages asking for a corrected query after the database rejected one
+    Reuses the cached system prompt, so only the short repair request is new
+    """
+    system_prompt = build_system_prompt(schema_info, custom_directive=custom_directive)
+    user_prompt = f"""The SQL query generated for this question failed when executed.
+
+USER QUESTION: "{user_query}"
+
+FAILED SQL:
+{failed_sql}
+
+DATABASE ERROR:
+{error[:500]}
+
+Return a corrected single SELECT query that answers the question, using only tables and columns from the schema.
+
+Return ONLY the JSON response, no other text.
+"""
+    return [("system", system_prompt), ("human", user_prompt)]
+
+
+def repair_sql_query(user_query: str, failed_sql: str, error: str, schema_info: dict, llm, custom_directive: str = None) -> dict:
+    """
+    One LLM call to fix a query the database rejected, given its error
+    Returns the same shape as generate_sql_query_with_llm
+    """
+    messages = _build_repair_messages(user_query, failed_sql, error, schema_info, custom_directive)
+    
+    try:
+        return _request_sql_response(llm, messages)
+    except Exception as e:
+        return _error_result(e)
+
+
+async def arepair_sql_query(user_query: str, failed_sql: str, error: str, schema_info: dict, llm, custom_directive: str = None) -> dict:
+    """Async variant of repair_sql_query"""
+    messages = _build_repair_messages(user_query, failed_sql, error, schema_info, custom_directive)
+    
+    try:
+        return await asyncio.to_thread(_request_sql_response, llm, messages)
     except Exception as e:
-        print(f"LLM Query Generation Error: {e}")
-        return {
-            "sql_query": None,
-            "reasoning": f"Error: {str(e)}",
-            "confidence": 0.0,
-            "tables_used": []
-        }
+        return _error_result(e)
@@ -0,0 +1,83 @@
+"""
+Two-tier cache for complete chat answers
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from extensions import cache
+from .schema_inspector import get_db_fingerprint
+
+# Answers from less confident SQL generation are never cached
+MIN_CACHE_CONFIDENCE = 0.6
+
+# In-process LRU in front of the shared application cache:
+# {cache key: (expiry, response)}; entries expire with the shared tier's
+# timeout, so neither tier serves an answer longer than the other
+_LOCAL_CACHE_SIZE = 128
+_local_responses = OrderedDict()
+_local_responses_lock = threading.Lock()
+
+
+def response_cache_key(db_config: dict, user_query: str, custom_directive: str, conversation_history: list) -> str:
+    """
+    Cache key for a chat answer: database, directive, normalized question
+    and the two turns before it, so follow-up questions don't collide
+    """
+    normalized_query = ' '.join(user_query.lower().split()).rstrip('?.! ')
+    history_tail = '\n'.join(msg.get('content', '') for msg in conversation_history[-3:-1])
+    digest = hashlib.sha256(
+        '\x1f'.join((custom_directive or '', normalized_query, history_tail)).encode()
+    ).hexdigest()
+    return f"chat:{get_db_fingerprint(db_config)}:{digest}"
+
+
+def _remember(cache_key: str, response: str, timeout: int):
+    with _local_responses_lock:
+        _local_responses[cache_key] = (time.monotonic() + timeout, response)
+        _local_responses.move_to_end(cache_key)
+        if len(_local_responses) > _LOCAL_CACHE_SIZE:
+            _local_responses.popitem(last=False)
+
+
+def get_cached_response(cache_key: str):
+    """Cached answer for cache_key, or None; the local LRU is checked first"""
+    with _local_responses_lock:
+        entry = _local_responses.get(cache_key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                _local_responses.move_to_end(cache_key)
+                return entry[1]
+            del _local_responses[cache_key]
+    
+    response = cache.get(cache_key)
+    if response is not None:
+        # The shared entry's remaining lifetime isn't exposed; a full
+        # timeout keeps a copy at most one timeout past it
+        _remember(cache_key, response, current_app.config['CACHE_DEFAULT_TIMEOUT'])
+    return response
+
+
+def cache_response(cache_key: str, response: str, confidence: float):
+    """Store an answer in both tiers, if it came from a confident query"""
+    if confidence < MIN_CACHE_CONFIDENCE:
+        return
+    timeout = current_app.config['CACHE_DEFAULT_TIMEOUT']
+    _remember(cache_key, response, timeout)
+    cache.set(cache_key, response, timeout=timeout)
+
+
+def invalidate_cached_responses(db_config: dict):
+    """
+    Forget cached answers for a database
+    Clears this process's entries from both tiers; answers other workers
+    cached expire with the shared cache timeout
+    """
+    prefix = f"chat:{get_db_fingerprint(db_config)}:"
+    with _local_responses_lock:
+        keys = [key for key in _local_responses if key.startswith(prefix)]
+        for key in keys:
+            del _local_responses[key]
+    if keys:
+        cache.delete_many(*keys)
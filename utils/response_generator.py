@@ -1,9 +1,197 @@
 """
 Natural language response generation from SQL results
 """
+import asyncio
+import logging
 import re
 import ast
 from decimal import Decimal
+from functools import lru_cache
+from itertools import islice
+
+logger = logging.getLogger(__name__)
+
+
+# Same per-value cap SQLDatabase.run applies to long strings
+_MAX_VALUE_LENGTH = 300
+
+# Most result rows written into the answer prompt; the rest are only counted
+_PROMPT_MAX_ROWS = 50
+
+# Patterns for cleaning stringified results, compiled once
+_DECIMAL_RE = re.compile(r"Decimal\(['\"]([^'\"]+)['\"]\)")
+_TUPLE_RE = re.compile(r'\(([^)]+)\)')
+_LIST_BRACKETS_TABLE = str.maketrans('', '', '[]')
+_IDENTIFIER_RE = re.compile(r'\w+')
+
+# Questions asking for a full listing; the phrases 'show all', 'give all',
+# 'list all' and 'give list' all contain 'list' or 'all' already
+_SHOW_ALL_RE = re.compile(r'list|all|what are', re.IGNORECASE)
+
+# Quoted strings, all-caps words, comma separators and hex escapes in one
+# alternation, so the fallback cleaning rewrites a string in a single scan;
+# the text variant also drops brackets (including any between a comma and
+# the next field, as removing them first used to)
+_FALLBACK_ROW_RE = re.compile(r"'([^']+)'|\b[A-Z]{2,}\b|,\s*|\\x[0-9a-fA-F]{2}")
+_FALLBACK_TEXT_RE = re.compile(r"[\[\]\(\)]|'([^']+)'|\b[A-Z]{2,}\b|,[\s\[\]\(\)]*|\\x[0-9a-fA-F]{2}")
+
+
+# Exact types of the numeric values drivers return; numeric-heavy results
+# (aggregates, analytics) skip the isinstance ladder
+_NUMERIC_TYPES = frozenset((int, float, Decimal))
+
+
+def _clean_value(value) -> str:
+    """Display form of a single result value"""
+    # Numbers display as floats; the exact-type test answers the common types
+    # without isinstance, which still catches subclasses such as bool
+    # (True -> "1.0") and IntEnum
+    if type(value) in _NUMERIC_TYPES or isinstance(value, (int, float, Decimal)):
+        return str(float(value))
+    
+    # Skip binary data (drivers return BLOBs as bytes or bytearray)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "[Binary Data - Image/BLOB]"
+    # Check for encoded binary strings: a \x escape near the start (which
+    # also covers a b\x prefix); find's bounds avoid slicing the value
+    if isinstance(value, str) and value.find('\\x', 0, 20) != -1:
+        return "[Binary Data - Image/BLOB]"
+    
+    if isinstance(value, str):
+        # Clean up formatting but preserve emails and URLs
+        cleaned_value = value.strip()
+        # Don't apply title case to emails, URLs, or already mixed-case strings;
+        # an all-caps value can only hold a URL scheme as 'HTTP', so no
+        # lowercased copy is needed
+        if cleaned_value.isupper() and '@' not in cleaned_value and 'HTTP' not in cleaned_value:
+            cleaned_value = cleaned_value.title()
+        return cleaned_value
+    if value is None:
+        return "NULL"
+    return str(value)
+
+
+def _format_value(value) -> str:
+    """_clean_value for a value straight from the driver, long strings capped"""
+    if type(value) is str:
+        value = value[:_MAX_VALUE_LENGTH]
+    return _clean_value(value)
+
+
+def clean_sql_rows(rows: list) -> str:
+    """
+    Formats result rows (tuples from run_query_rows) as pipe-separated lines
+    Values are real Python objects, so no string parsing is needed
+    """
+    return "\n".join(" | ".join(map(_format_value, row)) for row in rows)
+
+
+def _display_value(value) -> str:
+    """Plain display form of a value for templated answers"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "[Binary Data]"
+    if value is None:
+        return "N/A"
+    if isinstance(value, str):
+        return value.strip()
+    return str(value)
+
+
+# Larger or wider results go through the answer LLM, which can summarise them
+TEMPLATE_MAX_ROWS = 20
+TEMPLATE_MAX_COLUMNS = 4
+
+
+def render_answer_template(answer_template: str, rows: list):
+    """
+    Fills the {rows} placeholder of an LLM-written answer template with
+    query results: a single value inline, one column as a list, several
+    columns as one markdown bullet per row
+    Returns None when the result is too large, too wide or holds binary data
+    """
+    if len(rows) > TEMPLATE_MAX_ROWS or any(len(row) > TEMPLATE_MAX_COLUMNS for row in rows):
+        return None
+    if any(isinstance(value, (bytes, bytearray, memoryview)) for row in rows for value in row):
+        return None
+    
+    if len(rows) == 1 and len(rows[0]) == 1:
+        rendered = _display_value(rows[0][0])
+    elif all(len(row) == 1 for row in rows):
+        values = [_display_value(row[0]) for row in rows]
+        rendered = ", ".join(values[:-1]) + " and " + values[-1]
+    else:
+        rendered = "\n".join("- " + ", ".join(_display_value(value) for value in row) for row in rows)
+    
+    # Plain replace; the template is model output and may contain other braces
+    return answer_template.replace("{rows}", rendered)
+
+
+def _title_case(match) -> str:
+    return match.group(0).title()
+
+
+def _title_case_word(match) -> str:
+    """Title case, leaving anything that looks like a URL alone"""
+    # Matches are runs of A-Z, so a scheme shows up as 'HTTP' and an '@' never does
+    word = match.group(0)
+    if 'HTTP' in word:
+        return word
+    return word.title()
+
+
+def _clean_row_token(match) -> str:
+    """_FALLBACK_ROW_RE replacement: unquote, title-case, pipe-separate, drop escapes"""
+    token = match.group(0)
+    first = token[0]
+    if first == "'":
+        return _FALLBACK_ROW_RE.sub(_clean_row_token, match.group(1))
+    if first == ',':
+        return ' | '
+    if first == '\\':
+        return ''
+    return _title_case_word(match)
+
+
+def _clean_text_token(match) -> str:
+    """_FALLBACK_TEXT_RE replacement: as _clean_row_token, and brackets removed"""
+    token = match.group(0)
+    first = token[0]
+    if first == "'":
+        return _FALLBACK_TEXT_RE.sub(_clean_text_token, match.group(1))
+    if first == ',':
+        return ' | '
+    if first in '\\[]()':
+        return ''
+    return _title_case(match)
+
+
+# Single-column results up to this size are answered without the LLM
+TRIVIAL_MAX_ROWS = 10
+
+
+def _column_label(column: str) -> str:
+    """Readable label for a result column; expressions like COUNT(*) get a generic one"""
+    if not column or not _IDENTIFIER_RE.fullmatch(column):
+        return "Result"
+    return column.replace('_', ' ').strip().capitalize()
+
+
+def format_trivial_answer(columns: list, rows: list):
+    """
+    Answer for results that need no rewording: a single value, or a short
+    single column of values
+    Returns None for anything else, which goes to the answer LLM
+    """
+    if not rows or len(columns) != 1 or len(rows) > TRIVIAL_MAX_ROWS:
+        return None
+    values = [row[0] for row in rows]
+    if any(isinstance(value, (bytes, bytearray, memoryview)) for value in values):
+        return None
+    
+    label = _column_label(columns[0])
+    if len(values) == 1:
+        return f"**{label}:** {_display_value(values[0])}"
+    return f"**{label}:** " + ", ".join(_display_value(value) for value in values)
 
 
 def clean_sql_results(sql_result: str) -> str:
@@ -11,56 +199,28 @@ def clean_sql_results(sql_result: str) -> str:
     Preprocesses raw SQL results to remove Python formatting artifacts
     Converts Decimal objects, tuples, and other Python structures to clean text
     Filters out binary data (images, blobs)
+    Row tuples from run_query should go to clean_sql_rows instead; this is
+    for text, such as SQL agent output, that may embed a stringified result
     """
     try:
-        # Try to parse the result as Python literal
+        # Only a stringified list of rows is worth a literal_eval; prose (the
+        # usual agent output) goes straight to the regex cleaning
+        if not sql_result.lstrip().startswith('['):
+            raise ValueError("not a stringified result list")
         parsed = ast.literal_eval(sql_result)
         
-        cleaned_rows = []
-        
-        # Handle list of tuples (most common case)
-        if isinstance(parsed, list):
-            for item in parsed:
-                if isinstance(item, tuple):
-                    cleaned_items = []
-                    for value in item:
-                        # Skip binary data (bytes objects)
-                        if isinstance(value, bytes):
-                            cleaned_items.append("[Binary Data - Image/BLOB]")
-                            continue
-                        # Check for encoded binary strings
-                        if isinstance(value, str) and (value.startswith('b\\x') or '\\x' in value[:20]):
-                            cleaned_items.append("[Binary Data - Image/BLOB]")
-                            continue
-                            
-                        if isinstance(value, (int, float)) or (hasattr(value, '__class__') and 'Decimal' in str(type(value))):
-                            # Convert to float for cleaner display
-                            cleaned_items.append(str(float(value)))
-                        elif isinstance(value, str):
-                            # Clean up formatting but preserve emails and URLs
-                            cleaned_value = value.strip()
-                            # Don't apply title case to emails, URLs, or already mixed-case strings
-                            if '@' not in cleaned_value and 'http' not in cleaned_value.lower() and cleaned_value.isupper():
-                                cleaned_value = cleaned_value.title()
-                            cleaned_items.append(cleaned_value)
-                        elif value is None:
-                            cleaned_items.append("NULL")
-                        else:
-                            cleaned_items.append(str(value))
-                    cleaned_rows.append(" | ".join(cleaned_items))
-        
-        # Return cleaned result as pipe-separated values with clear formatting
-        cleaned_output = "\n".join(cleaned_rows)
-        
-        # Additional safety: remove any remaining Python artifacts
-        cleaned_output = re.sub(r"Decimal\(['\"]([^'\"]+)['\"]\)", r'\1', cleaned_output)
-        cleaned_output = cleaned_output.replace("[(", "").replace(")]", "")
-        
-        return cleaned_output
+        # Handle list of tuples (most common case), as pipe-separated values;
+        # _clean_value does all per-value formatting (title case included),
+        # so the joined output needs no further pass
+        if not isinstance(parsed, list):
+            return ""
+        return "\n".join(
+            " | ".join(map(_clean_value, item)) for item in parsed if isinstance(item, tuple)
+        )
     
     except Exception as e:
         # If parsing fails, do aggressive regex-based cleaning
-        print(f"Clean SQL Results Exception: {e}")
+        logger.debug("Clean SQL Results fell back to text cleaning: %s", e)
         
         # Check if this contains binary data
         if 'b\\x' in sql_result or '\\x89PNG' in sql_result:
@@ -70,80 +230,45 @@ def clean_sql_results(sql_result: str) -> str:
             sql_result = parts + " | [Binary Data - Image/BLOB removed]"
         
         # Remove Decimal() wrappers
-        cleaned = re.sub(r"Decimal\(['\"]([^'\"]+)['\"]\)", r'\1', sql_result)
+        cleaned = _DECIMAL_RE.sub(r'\1', sql_result)
         
         # First, try to identify individual tuples (rows)
         # Pattern: (...), (...), (...)
-        tuple_pattern = r'\(([^)]+)\)'
-        tuples = re.findall(tuple_pattern, cleaned)
+        tuples = _TUPLE_RE.findall(cleaned)
         
         if tuples and len(tuples) > 1:
-            # Multiple rows found - process each tuple as a separate row
-            cleaned_rows = []
-            for tuple_content in tuples:
-                # Remove quotes and clean up each field
-                row_cleaned = re.sub(r"'([^']+)'", r'\1', tuple_content)
-                # Convert to title case for uppercase words (but not emails/URLs)
-                def title_case_match(match):
-                    word = match.group(0)
-                    if '@' in word or 'http' in word.lower():
-                        return word
-                    return word.title()
-                row_cleaned = re.sub(r'\b[A-Z]{2,}\b', title_case_match, row_cleaned)
-                # Replace commas with pipes for field separation
-                row_cleaned = re.sub(r',\s*', ' | ', row_cleaned)
-                cleaned_rows.append(row_cleaned)
-            
-            # Join rows with newlines
-            cleaned = "\n".join(cleaned_rows)
-        else:
-            # Single row or unstructured data - use old approach
-            # Remove list/tuple brackets and parentheses
-            cleaned = cleaned.replace("[(", "").replace(")]", "")
-            cleaned = re.sub(r"[\[\]\(\)]", "", cleaned)
-            
-            # Remove extra quotes around strings
-            cleaned = re.sub(r"'([^']+)'", r'\1', cleaned)
-            
-            # Convert to title case for uppercase words
-            def title_case_match(match):
-                return match.group(0).title()
-            
-            cleaned = re.sub(r'\b[A-Z]{2,}\b', title_case_match, cleaned)
-            
-            # Clean up commas and spacing
-            cleaned = re.sub(r',\s*', ' | ', cleaned)
+            # Multiple rows found - process each tuple as a separate row:
+            # unquote fields, title-case uppercase words (but not emails/URLs),
+            # pipe-separate fields and drop hex escapes, in one pass per row
+            return "\n".join(_FALLBACK_ROW_RE.sub(_clean_row_token, tuple_content) for tuple_content in tuples)
         
-        # Remove any remaining hex escape sequences
-        cleaned = re.sub(r'\\x[0-9a-fA-F]{2}', '', cleaned)
-        
-        return cleaned
+        # Single row or unstructured data: the same, plus removing list/tuple
+        # brackets and parentheses
+        return _FALLBACK_TEXT_RE.sub(_clean_text_token, cleaned)
 
 
-def generate_natural_language_response(user_query: str, sql_result: str, llm, custom_directive: str = None) -> str:
+def _result_fields(sql_result, limit: int = None) -> tuple[list, int]:
     """
-    Converts raw SQL results into natural, conversational language
+    The first limit result rows as lists of display strings, plus the total
+    row count
+    Row tuples (from run_query_rows) are formatted directly, and only as many
+    as are needed; text results (e.g. from the SQL agent) are cleaned and
+    split on their pipes
     """
-    
-    # Build custom directive section if provided
-    directive_section = ""
-    if custom_directive:
-        directive_section = f"""
-CUSTOM CHATBOT DIRECTIVE:
-{custom_directive}
-
-CRITICAL: Your response MUST align with the directive above. Adopt the specified role, tone, and domain expertise when crafting your answer.
-{'='*50}
-
-"""
+    if not isinstance(sql_result, str):
+        fields = [list(map(_format_value, row)) for row in islice(sql_result, limit)]
+        return fields, len(sql_result)
     
     # Additional aggressive cleaning to ensure no raw format gets through
     sql_result_display = sql_result
     
-    # Remove any remaining Python artifacts that might have survived
-    sql_result_display = re.sub(r"Decimal\(['\"]([^'\"]+)['\"]\)", r'\1', sql_result_display)
+    # Remove any remaining Python artifacts that might have survived; text
+    # from clean_sql_results normally has no Decimal() left to unwrap, and
+    # fixed characters are dropped with a C-level translate
+    if 'Decimal(' in sql_result_display:
+        sql_result_display = _DECIMAL_RE.sub(r'\1', sql_result_display)
     sql_result_display = sql_result_display.replace("[(", "").replace(")]", "")
-    sql_result_display = re.sub(r"[\[\]]", "", sql_result_display)
+    sql_result_display = sql_result_display.translate(_LIST_BRACKETS_TABLE)
     
     # Try to pre-parse the pipe-separated data to help the LLM
     parsed_data = []
@@ -155,46 +280,24 @@ CRITICAL: Your response MUST align with the directive above. Adopt the specified
         elif line.strip():
             # Single field result (no pipes)
             parsed_data.append([line.strip()])
-    
-    # Build a simpler prompt
-    data_context = ""
-    show_all = any(word in user_query.lower() for word in ['list', 'all', 'show all', 'give all', 'what are', 'list all', 'give list'])
-    
-    # Debug: print if show_all is detected
-    if show_all:
-        print(f"DEBUG: LIST REQUEST DETECTED - Will show all {len(parsed_data)} items")
-    
-    if parsed_data:
-        data_context = "The database returned this data:\n"
-        
-        # Determine how many rows to show
-        max_rows_to_show = len(parsed_data) if show_all or len(parsed_data) <= 20 else 5
-        
-        for i, row in enumerate(parsed_data[:max_rows_to_show]):
-            if len(row) == 1:
-                # Single value
-                data_context += f"  {i+1}. {row[0]}\n"
-            else:
-                # Multiple fields
-                data_context += f"  Row {i+1}: {row}\n"
-        
-        if len(parsed_data) > max_rows_to_show:
-            data_context += f"  (... and {len(parsed_data) - max_rows_to_show} more rows - summarize these)\n"
-    
-    # Determine response instruction based on query type
-    list_instruction = ""
-    if show_all and len(parsed_data) <= 50:
-        list_instruction = f"\n\n🚨 CRITICAL INSTRUCTION 🚨\nThe user asked for a COMPLETE LIST of ALL items.\nYou MUST include EVERY SINGLE item from the {len(parsed_data)} items shown above.\nDO NOT say 'and others' or 'totaling X items' - LIST THEM ALL.\n\nFormat: 'She has worked in these genres: Documentary, Animation, New, Games, Sci-Fi, Classics, Horror, Sports, Family, Children, Foreign, Comedy, and Music.'"
-    
-    prompt = f"""{directive_section}You are a friendly database assistant. Your job is to explain query results in natural, conversational language.
+    return parsed_data[:limit], len(parsed_data)
+
+
+def _results_text(sql_result) -> str:
+    """Plain-text results for when the LLM call fails"""
+    return sql_result if isinstance(sql_result, str) else clean_sql_rows(sql_result)
+
+
+# Static parts of the result-to-language prompt, around the question and data
+_RESPONSE_PROMPT_INTRO = """You are a friendly database assistant. Your job is to explain query results in natural, conversational language.
 
 🚨 ABSOLUTE REQUIREMENT 🚨
 You MUST ALWAYS write in natural language sentences. NEVER show raw data formats.
 Pipe symbols (|), brackets, or raw field values are STRICTLY FORBIDDEN in your response.
 
-Question: "{user_query}"
+"""
 
-{data_context}{list_instruction}
+_RESPONSE_PROMPT_RULES = """
 
 MANDATORY PARSING INSTRUCTIONS:
 1. Read the data fields above
@@ -232,9 +335,156 @@ FORBIDDEN RESPONSES (DO NOT DO THIS):
 ❌ Any response containing the pipe symbol (|)
 
 Your response MUST be in natural language:"""
+
+
+@lru_cache(maxsize=32)
+def _directive_section(custom_directive: str) -> str:
+    """The directive block; formatted once per directive, which is fixed per session"""
+    return f"""
+CUSTOM CHATBOT DIRECTIVE:
+{custom_directive}
+
+CRITICAL: Your response MUST align with the directive above. Adopt the specified role, tone, and domain expertise when crafting your answer.
+{'='*50}
+
+"""
+
+
+def _build_response_prompt(user_query: str, sql_result, custom_directive: str = None, truncated: bool = False) -> str:
+    """
+    Builds the result-to-language prompt shared by the sync and async generators
+    sql_result is either row tuples or already-cleaned result text; truncated
+    means it holds only the first rows of a larger result
+    """
+    directive_section = _directive_section(custom_directive) if custom_directive else ""
+    
+    parsed_data, row_count = _result_fields(sql_result, _PROMPT_MAX_ROWS)
+    
+    # Build a simpler prompt
+    data_context = ""
+    show_all = _SHOW_ALL_RE.search(user_query) is not None
+    
+    if show_all:
+        logger.debug("LIST REQUEST DETECTED - Will show all %d items", row_count)
+    
+    if parsed_data:
+        lines = ["The database returned this data:\n"]
+        
+        # Determine how many rows to show
+        max_rows_to_show = min(row_count if show_all or row_count <= 20 else 5, _PROMPT_MAX_ROWS)
+        
+        # Single values numbered, multi-field rows shown whole
+        lines.extend(
+            f"  {i}. {row[0]}\n" if len(row) == 1 else f"  Row {i}: {row}\n"
+            for i, row in enumerate(islice(parsed_data, max_rows_to_show), 1)
+        )
+        
+        # row_count is only a lower bound for a truncated result, and must not
+        # be presented as the total
+        if truncated:
+            lines.append(
+                f"  (... at least {row_count} rows in total (result truncated) - "
+                "summarize these and do not state an exact total)\n"
+            )
+        elif row_count > max_rows_to_show:
+            lines.append(f"  (... and {row_count - max_rows_to_show} more rows - summarize these)\n")
+        
+        # Joined once rather than growing the string row by row
+        data_context = "".join(lines)
+    
+    # Determine response instruction based on query type
+    list_instruction = ""
+    if show_all and not truncated and row_count <= _PROMPT_MAX_ROWS:
+        list_instruction = f"\n\n🚨 CRITICAL INSTRUCTION 🚨\nThe user asked for a COMPLETE LIST of ALL items.\nYou MUST include EVERY SINGLE item from the {row_count} items shown above.\nDO NOT say 'and others' or 'totaling X items' - LIST THEM ALL.\n\nFormat: 'She has worked in these genres: Documentary, Animation, New, Games, Sci-Fi, Classics, Horror, Sports, Family, Children, Foreign, Comedy, and Music.'"
+    
+    # Only the directive, question and data vary; the rest are module constants
+    prompt = "".join((
+        directive_section,
+        _RESPONSE_PROMPT_INTRO,
+        f'Question: "{user_query}"\n\n',
+        data_context,
+        list_instruction,
+        _RESPONSE_PROMPT_RULES
+    ))
+    
+    return prompt
+
+
+def _fallback_response(sql_result) -> str:
+    """Plain results, for when the LLM call fails"""
+    return f"Here are the results:\n\n{_results_text(sql_result)}"
+
+
+def _stream_response(prompt: str, sql_result, llm):
+    """
+    Yield response text deltas as the LLM produces them
+    The generator returns whether the LLM wrote the whole answer, rather
+    than the plain-results fallback
+    """
+    try:
+        for chunk in llm.stream(prompt):
+            text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+            if text:
+                yield text
+    except Exception as e:
+        logger.warning("Response generation error: %s", e)
+        yield _fallback_response(sql_result)
+        return False
+    return True
+
+
+def _generate_response_with_status(user_query: str, sql_result, llm, custom_directive: str = None, stream: bool = False,
+                                   truncated: bool = False):
+    """
+    generate_natural_language_response, also reporting whether the LLM wrote
+    the answer - False means the call failed and the text is the plain-results fallback
+    Returns: (response text, flag), or with stream=True an iterator of text
+    deltas whose return value is the flag
+    """
+    prompt = _build_response_prompt(user_query, sql_result, custom_directive, truncated)
+    
+    if stream:
+        return _stream_response(prompt, sql_result, llm)
     
     try:
         response = llm.invoke(prompt)
-        return response.content if hasattr(response, 'content') else str(response)
+        return (response.content if hasattr(response, 'content') else str(response)), True
     except Exception as e:
-        return f"Here are the results:\n\n{sql_result}"
+        logger.warning("Response generation error: %s", e)
+        return _fallback_response(sql_result), False
+
+
+def generate_natural_language_response(user_query: str, sql_result, llm, custom_directive: str = None, stream: bool = False,
+                                       truncated: bool = False):
+    """
+    Converts SQL results (row tuples or cleaned text) into natural, conversational language
+    With stream=True, returns an iterator of text deltas instead
+    """
+    result = _generate_response_with_status(user_query, sql_result, llm, custom_directive, stream, truncated)
+    return result if stream else result[0]
+
+
+async def _agenerate_response_with_status(user_query: str, sql_result, llm, custom_directive: str = None,
+                                          truncated: bool = False) -> tuple[str, bool]:
+    """
+    Async variant of _generate_response_with_status
+    The blocking call runs in a worker thread so shared clients never bind
+    to a per-request event loop
+    """
+    prompt = _build_response_prompt(user_query, sql_result, custom_directive, truncated)
+    
+    try:
+        response = await asyncio.to_thread(llm.invoke, prompt)
+        return (response.content if hasattr(response, 'content') else str(response)), True
+    except Exception as e:
+        logger.warning("Response generation error: %s", e)
+        return _fallback_response(sql_result), False
+
+
+async def agenerate_natural_language_response(user_query: str, sql_result, llm, custom_directive: str = None,
+                                              truncated: bool = False) -> str:
+    """
+    Async variant of generate_natural_language_response
+    """
+    response, _ = await _agenerate_response_with_status(user_query, sql_result, llm, custom_directive, truncated)
+    return response
@@ -1,47 +1,328 @@
 """
 Database schema discovery and inspection
 """
-from sqlalchemy import inspect
-from .db_manager import get_db_chain
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import orjson
+from flask import current_app
+from extensions import cache
+from .db_manager import get_engine
 
 
-def get_database_schema_info(db_config: dict) -> dict:
+@lru_cache(maxsize=256)
+def _fingerprint(host: str, port: int, database: str, user: str) -> str:
+    return hashlib.sha256(f"{host}|{port}|{database}|{user}".encode()).hexdigest()
+
+
+def get_db_fingerprint(db_config: dict) -> str:
+    """
+    Stable identifier for a database connection (no credentials)
+    Derived only from host, port, database and user, so reconnecting with
+    the same target reuses every cache keyed by it
+    """
+    return _fingerprint(db_config['host'], db_config.get('port', 3306), db_config['database'], db_config['user'])
+
+
+def get_schema_version(schema_info: dict) -> str:
+    """
+    Content hash of a schema, so anything derived from it can be cached
+    until the schema actually changes (e.g. after a refresh)
+    """
+    version = schema_info.get('version')
+    if version is None:
+        content = orjson.dumps(
+            {'tables': schema_info['tables'], 'relationships': schema_info['relationships']},
+            option=orjson.OPT_SORT_KEYS, default=str
+        )
+        version = schema_info['version'] = hashlib.sha256(content).hexdigest()
+    return version
+
+
+# Order-independent checksum of every column definition and the foreign key
+# count; one cheap information_schema query that changes with any DDL
+_MYSQL_STRUCTURE_QUERY = """
+    SELECT COUNT(*),
+           COALESCE(SUM(CRC32(CONCAT_WS('|', TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY))), 0),
+           (SELECT COUNT(*) FROM information_schema.REFERENTIAL_CONSTRAINTS WHERE CONSTRAINT_SCHEMA = :schema)
+    FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = :schema
+"""
+
+
+def _structure_fingerprint(db_config: dict) -> str:
+    """
+    Changes whenever tables, columns or foreign keys change (MySQL only;
+    empty for other databases, which then rely on the cache timeout)
+    """
+    from sqlalchemy import text
+    
+    engine = get_engine(db_config)
+    if engine.dialect.name != 'mysql':
+        return ''
+    with engine.connect() as conn:
+        row = conn.execute(text(_MYSQL_STRUCTURE_QUERY), {'schema': db_config['database']}).one()
+    return '-'.join(str(value) for value in row)
+
+
+# Schemas this process has already loaded, keyed like the shared cache:
+# {cache key: (expiry, schema_info)}; spares re-reading and unpickling the
+# whole schema from the shared store on every session's first question
+_LOCAL_SCHEMA_CACHE_SIZE = 32
+_local_schemas = OrderedDict()
+_local_schemas_lock = threading.Lock()
+
+
+def _remember_schema(cache_key: str, schema_info: dict, timeout: int):
+    with _local_schemas_lock:
+        _local_schemas[cache_key] = (time.monotonic() + timeout, schema_info)
+        _local_schemas.move_to_end(cache_key)
+        if len(_local_schemas) > _LOCAL_SCHEMA_CACHE_SIZE:
+            _local_schemas.popitem(last=False)
+
+
+def get_cached_schema_info(db_config: dict, refresh: bool = False) -> dict:
+    """
+    Read-through schema lookup in the shared application cache
+    Keyed by the database's structure fingerprint, so a schema change is
+    picked up by the next lookup and an unchanged schema is never rebuilt;
+    introspects only on a cache miss or when refresh is requested
+    """
+    cache_key = f"schema:{get_db_fingerprint(db_config)}:{_structure_fingerprint(db_config)}"
+    timeout = current_app.config['SCHEMA_CACHE_TIMEOUT']
+    
+    if not refresh:
+        with _local_schemas_lock:
+            entry = _local_schemas.get(cache_key)
+            if entry is not None and entry[0] > time.monotonic():
+                _local_schemas.move_to_end(cache_key)
+                return entry[1]
+        
+        schema_info = cache.get(cache_key)
+        if schema_info:
+            _remember_schema(cache_key, schema_info, timeout)
+            return schema_info
+    
+    schema_info = get_database_schema_info(db_config, include_samples=current_app.config['SCHEMA_SAMPLE_DATA'])
+    cache.set(cache_key, schema_info, timeout=timeout)
+    _remember_schema(cache_key, schema_info, timeout)
+    return schema_info
+
+
+# Upper bound on concurrent sample-data queries (stays within the engine pool)
+_SAMPLE_WORKERS = 16
+
+# Shared by every schema build, so threads are started once and concurrent
+# builds together stay within the bound
+_sample_executor = ThreadPoolExecutor(max_workers=_SAMPLE_WORKERS, thread_name_prefix='schema-sample')
+
+_MYSQL_COLUMNS_QUERY = """
+    SELECT c.TABLE_NAME, c.COLUMN_NAME, c.COLUMN_TYPE, c.IS_NULLABLE, c.COLUMN_KEY
+    FROM information_schema.COLUMNS c
+    JOIN information_schema.TABLES t
+      ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+    WHERE c.TABLE_SCHEMA = :schema AND t.TABLE_TYPE = 'BASE TABLE'
+    ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
+"""
+
+_MYSQL_FOREIGN_KEYS_QUERY = """
+    SELECT k.TABLE_NAME, k.CONSTRAINT_NAME, k.COLUMN_NAME,
+           k.REFERENCED_TABLE_SCHEMA, k.REFERENCED_TABLE_NAME, k.REFERENCED_COLUMN_NAME
+    FROM information_schema.KEY_COLUMN_USAGE k
+    JOIN information_schema.REFERENTIAL_CONSTRAINTS r
+      ON r.CONSTRAINT_SCHEMA = k.CONSTRAINT_SCHEMA AND r.CONSTRAINT_NAME = k.CONSTRAINT_NAME
+     AND r.TABLE_NAME = k.TABLE_NAME
+    WHERE k.TABLE_SCHEMA = :schema AND k.REFERENCED_TABLE_NAME IS NOT NULL
+    ORDER BY k.TABLE_NAME, k.CONSTRAINT_NAME, k.ORDINAL_POSITION
+"""
+
+
+def _as_str(value) -> str:
+    """mysql-connector may return information_schema text as bytes"""
+    return value.decode() if isinstance(value, (bytes, bytearray)) else value
+
+
+def _type_label(column_type: str) -> str:
+    """
+    COLUMN_TYPE upper-cased as reflection renders it, except inside the
+    parentheses: ENUM/SET literals are data, and the LLM must match their
+    case in WHERE clauses
+    """
+    name, paren, rest = column_type.partition('(')
+    args, close, modifiers = rest.rpartition(')')
+    if not close:
+        return name.upper() + paren + rest
+    return f"{name.upper()}({args}){modifiers.upper()}"
+
+
+def _fetch_mysql_columns(engine, database: str) -> dict:
+    """
+    Column and primary key metadata for every table in a single query
+    Returns: {table_name: {'columns': [...], 'primary_key': [...]}}
+    """
+    from sqlalchemy import text
+    
+    tables = {}
+    with engine.connect() as conn:
+        for row in conn.execute(text(_MYSQL_COLUMNS_QUERY), {'schema': database}):
+            table_name, column_name, column_type, is_nullable, column_key = map(_as_str, row)
+            table = tables.setdefault(table_name, {'columns': [], 'primary_key': []})
+            table['columns'].append({
+                'name': column_name,
+                'type': _type_label(column_type),
+                'nullable': is_nullable == 'YES'
+            })
+            if column_key == 'PRI':
+                table['primary_key'].append(column_name)
+    return tables
+
+
+def _fetch_mysql_foreign_keys(engine, database: str) -> dict:
+    """
+    Foreign keys for every table in a single query, in the inspector's shape
+    Returns: {table_name: [{'name', 'constrained_columns', 'referred_table', ...}]}
+    """
+    from sqlalchemy import text
+    
+    tables = {}
+    with engine.connect() as conn:
+        for row in conn.execute(text(_MYSQL_FOREIGN_KEYS_QUERY), {'schema': database}):
+            table_name, name, column, referred_schema, referred_table, referred_column = map(_as_str, row)
+            fks = tables.setdefault(table_name, [])
+            if not fks or fks[-1]['name'] != name:
+                fks.append({
+                    'name': name,
+                    'constrained_columns': [],
+                    'referred_schema': referred_schema if referred_schema != database else None,
+                    'referred_table': referred_table,
+                    'referred_columns': [],
+                    'options': {}
+                })
+            fks[-1]['constrained_columns'].append(column)
+            fks[-1]['referred_columns'].append(referred_column)
+    return tables
+
+
+def _reflect_tables(engine) -> dict:
+    """
+    Column, primary key and foreign key metadata for every table through one
+    MetaData reflection, which dialects can batch (non-MySQL dialects)
+    Returns: {table_name: ({'columns': [...], 'primary_key': [...]}, foreign keys)}
+    """
+    from sqlalchemy import MetaData
+    
+    metadata = MetaData()
+    metadata.reflect(bind=engine, views=False)
+    
+    tables = {}
+    for table_name in sorted(metadata.tables):
+        table = metadata.tables[table_name]
+        columns = {
+            'columns': [
+                {
+                    'name': col.name,
+                    'type': str(col.type),
+                    'nullable': col.nullable
+                } for col in table.columns
+            ],
+            'primary_key': [col.name for col in table.primary_key.columns]
+        }
+        fks = [
+            {
+                'name': fk.name,
+                'constrained_columns': [col.name for col in fk.columns],
+                'referred_schema': fk.referred_table.schema,
+                'referred_table': fk.referred_table.name,
+                'referred_columns': [element.column.name for element in fk.elements],
+                'options': {}
+            } for fk in table.foreign_key_constraints
+        ]
+        tables[table_name] = (columns, fks)
+    return tables
+
+
+def _sample_value(value):
+    """Keeps long text and binary columns from bloating the cached schema"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, str) and len(value) > 100:
+        return value[:100] + "..."
+    return value
+
+
+def _fetch_sample_data(conn, table_name: str):
+    """Get sample data to understand content"""
+    from sqlalchemy import literal_column, select, table
+    
+    try:
+        # A Core statement: the dialect quotes the name and renders the row
+        # limit in its own syntax (LIMIT, TOP, FETCH FIRST)
+        statement = select(literal_column('*')).select_from(table(table_name)).limit(3)
+        rows = conn.execute(statement).fetchall()
+        return str([tuple(_sample_value(value) for value in row) for row in rows])
+    except:
+        # Some databases refuse further statements until a failed one is rolled back
+        conn.rollback()
+        return "No sample data available"
+
+
+def _fetch_sample_batch(engine, table_names: list) -> list:
+    """
+    Sample data for several tables over one pooled connection, so the batch
+    pays for a single checkout (and pre-ping) instead of one per table
+    """
+    try:
+        with engine.connect() as conn:
+            return [_fetch_sample_data(conn, table_name) for table_name in table_names]
+    except:
+        return ["No sample data available"] * len(table_names)
+
+
+def get_database_schema_info(db_config: dict, include_samples: bool = True) -> dict:
     """
     Automatically extracts complete database schema information
     NO hardcoding - works with ANY database structure
     """
-    db = get_db_chain(db_config)
-    engine = db._engine
-    inspector = inspect(engine)
+    engine = get_engine(db_config)
     
     schema_info = {
         'tables': {},
-        'relationships': [],
-        'description': ""
+        'relationships': []
     }
     
-    # Extract all table information
-    for table_name in inspector.get_table_names():
-        columns = inspector.get_columns(table_name)
-        pk = inspector.get_pk_constraint(table_name)
-        fks = inspector.get_foreign_keys(table_name)
-        
-        # Get sample data to understand content
-        try:
-            sample_query = f"SELECT * FROM {table_name} LIMIT 3"
-            sample_data = db.run(sample_query)
-        except:
-            sample_data = "No sample data available"
-        
+    # Metadata: two information_schema round-trips on MySQL, otherwise a
+    # single MetaData reflection
+    if engine.dialect.name == 'mysql':
+        table_columns = _fetch_mysql_columns(engine, db_config['database'])
+        table_fks = _fetch_mysql_foreign_keys(engine, db_config['database'])
+        table_names = list(table_columns)
+        table_meta = [(table_columns[t], table_fks.get(t, [])) for t in table_names]
+    else:
+        reflected = _reflect_tables(engine)
+        table_names = list(reflected)
+        table_meta = list(reflected.values())
+    
+    # Sample rows are independent per table: fetch them concurrently, in up to
+    # _SAMPLE_WORKERS contiguous batches that each reuse one connection
+    samples = [None] * len(table_names)
+    if include_samples and table_names:
+        batch_size = -(-len(table_names) // _SAMPLE_WORKERS)
+        batches = [table_names[i:i + batch_size] for i in range(0, len(table_names), batch_size)]
+        samples = [
+            sample
+            for batch in _sample_executor.map(lambda batch: _fetch_sample_batch(engine, batch), batches)
+            for sample in batch
+        ]
+    
+    # Extract all table information, in the database's table order
+    for table_name, (columns, fks), sample_data in zip(table_names, table_meta, samples):
         schema_info['tables'][table_name] = {
-            'columns': [
-                {
-                    'name': col['name'],
-                    'type': str(col['type']),
-                    'nullable': col['nullable']
-                } for col in columns
-            ],
-            'primary_key': pk.get('constrained_columns', []),
+            'columns': columns['columns'],
+            'primary_key': columns['primary_key'],
             'foreign_keys': fks,
             'sample_data': sample_data
         }
@@ -55,15 +336,132 @@ def get_database_schema_info(db_config: dict) -> dict:
                 'to_column': fk['referred_columns'][0] if fk['referred_columns'] else None
             })
     
-    # Generate human-readable description
-    description = "DATABASE SCHEMA:\n\n"
-    for table_name, info in schema_info['tables'].items():
-        description += f"📊 Table: {table_name}\n"
-        description += f"   Columns: {', '.join([col['name'] + ' (' + col['type'] + ')' for col in info['columns']])}\n"
-        if info['foreign_keys']:
-            for fk in info['foreign_keys']:
-                description += f"   🔗 Links to: {fk['referred_table']}\n"
-        description += f"   Sample: {str(info['sample_data'])[:100]}...\n\n"
-    
-    schema_info['description'] = description
+    get_schema_version(schema_info)
+    
+    # Render the full prompt block now, into the process-local blob cache;
+    # it is kept off schema_info, which is stored in every session
+    build_schema_blob(schema_info)
     return schema_info
+
+
+# Schemas up to this many tables are always described to the LLM in full
+FULL_SCHEMA_TABLE_LIMIT = 15
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+def _singular(word: str) -> str:
+    """Crude singular form so 'films'/'categories' match 'film'/'category'"""
+    if word.endswith('ies') and len(word) > 4:
+        return word[:-3] + 'y'
+    if word.endswith('s') and not word.endswith('ss') and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+@lru_cache(maxsize=1024)
+def _table_name_words(table_name: str) -> tuple:
+    """Singular words of a table name worth matching (longer than two letters)"""
+    return tuple(_singular(part) for part in _WORD_RE.findall(table_name.lower()) if len(part) > 2)
+
+
+def select_relevant_tables(user_query: str, schema_info: dict, conversation_history: list = None):
+    """
+    Picks the tables worth describing to the LLM for this question
+    Small schemas are sent whole (returns None). Wide schemas are narrowed
+    to tables named in the question or recent turns, plus their direct
+    foreign-key neighbours; None again if nothing matches.
+    """
+    tables = schema_info['tables']
+    if len(tables) <= FULL_SCHEMA_TABLE_LIMIT:
+        return None
+    
+    texts = [user_query]
+    if conversation_history:
+        texts.extend(msg.get('content', '') for msg in conversation_history[-3:])
+    words = {_singular(word) for word in _WORD_RE.findall(' '.join(texts).lower())}
+    
+    selected = {
+        table_name for table_name in tables
+        if any(word in words for word in _table_name_words(table_name))
+    }
+    if not selected:
+        return None
+    
+    # Keep join paths available
+    neighbours = set()
+    for rel in schema_info['relationships']:
+        if rel['from_table'] in selected:
+            neighbours.add(rel['to_table'])
+        if rel['to_table'] in selected:
+            neighbours.add(rel['from_table'])
+    selected |= neighbours
+    
+    return [table_name for table_name in tables if table_name in selected]
+
+
+def build_schema_description(schema_info: dict, table_names: list = None) -> str:
+    """
+    Human-readable schema description for the LLM prompt
+    Describes only table_names when given, otherwise every table
+    """
+    if table_names is None:
+        table_names = list(schema_info['tables'])
+    
+    parts = ["DATABASE SCHEMA:\n\n"]
+    for table_name in table_names:
+        info = schema_info['tables'][table_name]
+        parts.append(f"📊 Table: {table_name}\n")
+        columns = ', '.join(f"{col['name']} ({col['type']})" for col in info['columns'])
+        parts.append(f"   Columns: {columns}\n")
+        for fk in info['foreign_keys']:
+            parts.append(f"   🔗 Links to: {fk['referred_table']}\n")
+        if info['sample_data'] is not None:
+            parts.append(f"   Sample: {str(info['sample_data'])[:100]}...\n")
+        parts.append("\n")
+    
+    return "".join(parts)
+
+
+# Rendered schema blocks, keyed by (schema version, described tables)
+_SCHEMA_BLOB_CACHE_SIZE = 32
+_schema_blobs = OrderedDict()
+_schema_blobs_lock = threading.Lock()
+
+
+def _relationship_line(rel: dict) -> str:
+    """One foreign key as 'table.column -> table.column'"""
+    source = f"{rel['from_table']}.{rel['from_column']}" if rel['from_column'] else rel['from_table']
+    target = f"{rel['to_table']}.{rel['to_column']}" if rel['to_column'] else rel['to_table']
+    return f"{source} -> {target}"
+
+
+def build_schema_blob(schema_info: dict, table_names: list = None) -> str:
+    """
+    Schema description plus relationships, as embedded in the SQL prompt
+    Rendered once per schema version and table selection, with one line per
+    relationship (a fraction of the tokens of indented JSON) in schema order,
+    so the same schema always yields the same bytes
+    """
+    key = (get_schema_version(schema_info), tuple(table_names) if table_names is not None else None)
+    with _schema_blobs_lock:
+        blob = _schema_blobs.get(key)
+        if blob is not None:
+            _schema_blobs.move_to_end(key)
+            return blob
+    
+    relationships = schema_info['relationships']
+    if table_names is not None:
+        relationships = [rel for rel in relationships if rel['from_table'] in table_names]
+    
+    relationship_lines = "\n".join(map(_relationship_line, relationships)) or "(none)"
+    blob = f"""{build_schema_description(schema_info, table_names)}
+RELATIONSHIPS:
+{relationship_lines}
+"""
+    
+    with _schema_blobs_lock:
+        _schema_blobs[key] = blob
+        if len(_schema_blobs) > _SCHEMA_BLOB_CACHE_SIZE:
+            _schema_blobs.popitem(last=False)
+    return blob
@@ -0,0 +1,87 @@
+"""
+Local out-of-scope detection with sentence embeddings
+Optional: needs the fastembed package; without it every question is in scope
+"""
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from .schema_inspector import get_schema_version
+
+logger = logging.getLogger(__name__)
+
+_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Normalized schema term embeddings, keyed by schema version
+_SCHEMA_EMBEDDINGS_CACHE_SIZE = 8
+_schema_embeddings = OrderedDict()
+_schema_embeddings_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _get_embedder():
+    """Process-wide embedding model, or None when fastembed isn't installed"""
+    try:
+        from fastembed import TextEmbedding
+    except ImportError:
+        logger.warning("fastembed is not installed; out-of-scope check disabled")
+        return None
+    return TextEmbedding(_EMBEDDING_MODEL)
+
+
+def _embed(embedder, texts: list):
+    """Unit-length embeddings, so dot products are cosine similarities"""
+    import numpy as np
+    
+    vectors = np.array(list(embedder.embed(texts)), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _schema_terms(schema_info: dict) -> list:
+    """Table names, table.column pairs and sample rows to compare questions against"""
+    terms = []
+    for table_name, info in schema_info['tables'].items():
+        readable_table = table_name.replace('_', ' ')
+        terms.append(readable_table)
+        terms.extend(f"{readable_table} {col['name'].replace('_', ' ')}" for col in info['columns'])
+        if info['sample_data'] is not None:
+            terms.append(f"{readable_table}: {str(info['sample_data'])[:200]}")
+    return terms
+
+
+def _get_schema_embeddings(embedder, schema_info: dict):
+    version = get_schema_version(schema_info)
+    with _schema_embeddings_lock:
+        embeddings = _schema_embeddings.get(version)
+        if embeddings is not None:
+            _schema_embeddings.move_to_end(version)
+            return embeddings
+    
+    embeddings = _embed(embedder, _schema_terms(schema_info))
+    
+    with _schema_embeddings_lock:
+        _schema_embeddings[version] = embeddings
+        if len(_schema_embeddings) > _SCHEMA_EMBEDDINGS_CACHE_SIZE:
+            _schema_embeddings.popitem(last=False)
+    return embeddings
+
+
+def is_out_of_scope(user_query: str, schema_info: dict, threshold: float, previous_question: str = None) -> bool:
+    """
+    True when the question is unrelated to anything in the schema
+    Compares the question (and, for follow-ups, the question together with
+    the previous one) against schema terms; disabled when threshold <= 0 or
+    fastembed is unavailable
+    """
+    if threshold <= 0 or not schema_info.get('tables'):
+        return False
+    embedder = _get_embedder()
+    if embedder is None:
+        return False
+    
+    queries = [user_query]
+    if previous_question:
+        queries.append(f"{previous_question} {user_query}")
+    
+    similarities = _embed(embedder, queries) @ _get_schema_embeddings(embedder, schema_info).T
+    return float(similarities.max()) < threshold
@@ -2,62 +2,78 @@
 Security module for SQL injection prevention and query validation
 """
 import re
+from functools import lru_cache
 
 
+# Keywords that modify data or schema, matched as whole words in one pass;
+# case-insensitive, so queries are checked without an uppercased copy
+_FORBIDDEN_RE = re.compile(
+    r'\b(INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|TRUNCATE|REPLACE|MERGE|GRANT|REVOKE'
+    r'|EXEC|EXECUTE|CALL|LOAD|RENAME)\b',
+    re.IGNORECASE
+)
+
+# Leading SELECT (used with match)
+_SELECT_RE = re.compile(r'\s*SELECT', re.IGNORECASE)
+
+# Line and block comments
+_COMMENT_RE = re.compile(r'--[^\n]*|/\*.*?\*/', re.DOTALL)
+
+# Potential SQL injection patterns in user input; same flags as the
+# per-pattern subs they replace, so block comments spanning lines are kept
+_DANGEROUS_RE = re.compile(
+    r';\s*(?:DROP|DELETE|UPDATE|INSERT)|UNION\s+SELECT|--\s*$|/\*.*?\*/',
+    re.IGNORECASE
+)
+
+# Requests to change data in plain English, e.g. "Delete the rows from orders":
+# a sentence opening with a write verb (optionally after "please") that takes
+# a data object directly. Verbs followed by a person or topic ("Update me on
+# ...") and questions that merely mention updates still reach the LLM
+_MODIFY_REQUEST_RE = re.compile(
+    r'(?:^|[.!?;]\s+)\s*(?:please\s+)?(?:delete|drop|truncate|update|insert|alter)\s+'
+    r'(?:all\s+)?(?:the\s+)?(?:from\s+|into\s+)?'
+    r'(?!(?:me|us|you|him|her|them|on|about|with|regarding)\b)\w+',
+    re.IGNORECASE
+)
+
+
+@lru_cache(maxsize=1024)
 def is_read_only_query(sql_query: str) -> tuple[bool, str]:
     """
     Validates that SQL query is read-only (SELECT only)
+    Memoized: repeated questions reuse their cached SQL, so the same
+    statements come back for validation
     Returns: (is_valid, error_message)
     """
     if not sql_query:
         return False, "Empty query"
     
-    # Convert to uppercase for checking
-    sql_upper = sql_query.upper().strip()
-    
-    # List of forbidden keywords that modify data
-    forbidden_keywords = [
-        'INSERT', 'UPDATE', 'DELETE', 'DROP', 'CREATE', 'ALTER',
-        'TRUNCATE', 'REPLACE', 'MERGE', 'GRANT', 'REVOKE',
-        'EXEC', 'EXECUTE', 'CALL', 'LOAD', 'RENAME'
-    ]
-    
-    # Check for forbidden keywords
-    for keyword in forbidden_keywords:
-        # Use word boundaries to avoid false positives
-        pattern = r'\b' + keyword + r'\b'
-        if re.search(pattern, sql_upper):
-            return False, f"⚠️ Security Alert: {keyword} operations are not allowed. This chatbot is read-only."
+    # Check for forbidden keywords (word boundaries avoid false positives)
+    match = _FORBIDDEN_RE.search(sql_query)
+    if match:
+        return False, f"⚠️ Security Alert: {match.group(1).upper()} operations are not allowed. This chatbot is read-only."
     
-    # Ensure query starts with SELECT (after removing comments)
-    # Remove SQL comments
-    sql_no_comments = re.sub(r'--.*$', '', sql_upper, flags=re.MULTILINE)
-    sql_no_comments = re.sub(r'/\*.*?\*/', '', sql_no_comments, flags=re.DOTALL)
-    sql_no_comments = sql_no_comments.strip()
-    
-    if not sql_no_comments.startswith('SELECT'):
+    # Ensure query starts with SELECT (after removing comments, which only
+    # needs doing when it doesn't already)
+    if not _SELECT_RE.match(sql_query) and not _SELECT_RE.match(_COMMENT_RE.sub('', sql_query)):
         return False, "⚠️ Only SELECT queries are allowed. This chatbot cannot modify data."
     
     return True, ""
 
 
+@lru_cache(maxsize=4096)
 def sanitize_user_input(user_input: str) -> str:
     """
     Sanitize user input to prevent injection attempts
     """
     # Remove potential SQL injection patterns
-    dangerous_patterns = [
-        r';\s*DROP',
-        r';\s*DELETE',
-        r';\s*UPDATE',
-        r';\s*INSERT',
-        r'UNION\s+SELECT',
-        r'--\s*$',
-        r'/\*.*?\*/',
-    ]
-    
-    cleaned = user_input
-    for pattern in dangerous_patterns:
-        cleaned = re.sub(pattern, '', cleaned, flags=re.IGNORECASE)
-    
-    return cleaned
+    return _DANGEROUS_RE.sub('', user_input)
+
+
+def is_modification_request(user_input: str) -> bool:
+    """
+    Whether a question plainly asks to change data, so it can be refused
+    before any SQL is generated (generated SQL is still validated)
+    """
+    return _MODIFY_REQUEST_RE.search(user_input) is not None
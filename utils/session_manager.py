@@ -3,6 +3,14 @@ Session management utilities for Flask
 """
 from flask import session
 
+# Immutable defaults for keys a new session starts with
+_SESSION_DEFAULTS = {
+    'db_config': None,
+    'db_connected': False,
+    'chatbot_directive': None,
+    'schema_cache': None,
+}
+
 
 def get_session_data(key: str, default=None):
     """Retrieve session data"""
@@ -21,13 +29,7 @@ def clear_session():
 
 def init_session():
     """Initialize session with default values"""
-    if 'messages' not in session:
-        session['messages'] = []
-    if 'db_config' not in session:
-        session['db_config'] = None
-    if 'db_connected' not in session:
-        session['db_connected'] = False
-    if 'chatbot_directive' not in session:
-        session['chatbot_directive'] = None
-    if 'schema_cache' not in session:
-        session['schema_cache'] = None
+    # A fresh list per session, so no two sessions share one history
+    session.setdefault('messages', [])
+    for key, value in _SESSION_DEFAULTS.items():
+        session.setdefault(key, value)
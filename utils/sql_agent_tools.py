@@ -0,0 +1,44 @@
+"""
+Row-bounded query tool for the LangChain SQL agent fallback
+Imported only when the agent is first built, since it loads LangChain
+"""
+from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
+from langchain_community.tools.sql_database.tool import QuerySQLDataBaseTool
+
+from .db_manager import run_query
+
+# Most rows one agent query returns; the rest stays on the server
+AGENT_PAGE_ROWS = 200
+
+
+class PagedQuerySQLDataBaseTool(QuerySQLDataBaseTool):
+    """
+    Query tool that reads at most AGENT_PAGE_ROWS rows of a result
+    Rows are streamed and reading stops at the cap, so neither this process
+    nor the agent's context ever holds a whole table; the agent is told to
+    page with LIMIT/OFFSET when there is more
+    """
+    
+    def _run(self, query: str, run_manager=None) -> str:
+        try:
+            _, rows = run_query(self.db, query, max_rows=AGENT_PAGE_ROWS + 1)
+        except Exception as e:
+            return f"Error: {e}"
+        
+        if len(rows) <= AGENT_PAGE_ROWS:
+            return str(rows) if rows else ""
+        return (
+            f"{rows[:AGENT_PAGE_ROWS]}\n(First {AGENT_PAGE_ROWS} rows only; add an ORDER BY "
+            f"with LIMIT {AGENT_PAGE_ROWS} OFFSET n to read further, or aggregate instead)"
+        )
+
+
+class PagedSQLDatabaseToolkit(SQLDatabaseToolkit):
+    """SQLDatabaseToolkit whose query tool is row-bounded"""
+    
+    def get_tools(self) -> list:
+        return [
+            PagedQuerySQLDataBaseTool(db=self.db, description=tool.description)
+            if isinstance(tool, QuerySQLDataBaseTool) else tool
+            for tool in super().get_tools()
+        ]